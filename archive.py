@@ -0,0 +1,217 @@
+"""Image dataset read directly from an uncompressed tar archive"""
+
+import os
+import mmap
+import tarfile
+import threading
+import numpy as np
+
+# separates the archive path from the member name in a file path,
+# e.g. 'downloads/images.tar::Images/n02085620-Chihuahua/n02085620_7.jpg'
+MEMBER_SEP = "::"
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def split_path(file_path):
+    """Split a file path into archive path and member name
+
+    Returns
+    -------
+    tar_path : str, path to archive, None if file_path is a regular file
+    member : str, member name, or file_path if it is a regular file
+    """
+    if MEMBER_SEP in file_path:
+        tar_path, member = file_path.split(MEMBER_SEP, 1)
+        return tar_path, member
+    return None, file_path
+
+
+def open_source(tar_path):
+    """TarImageSource for tar_path, opened once per process"""
+    with _sources_lock:
+        source = _sources.get(tar_path)
+        if source is None:
+            source = TarImageSource(tar_path)
+            _sources[tar_path] = source
+        return source
+
+
+def read_bytes(file_path):
+    """Read the bytes of an image file or of a member in an archive,
+    see split_path"""
+    tar_path, member = split_path(file_path)
+    if tar_path is not None:
+        return open_source(tar_path).read(member)
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+def source_stat(file_path):
+    """os.stat of the file holding file_path, the archive for members"""
+    tar_path, member = split_path(file_path)
+    return os.stat(member if tar_path is None else tar_path)
+
+
+class TarImageSource:
+    """Serve image file bytes straight from a tar archive
+
+    Member data offsets are found by one pass over the archive headers
+    and saved next to it, so later runs open the dataset without reading
+    the archive.  Members are read from a read only memory map of the
+    archive, or with seek and read where it can't be mapped.  The map is
+    opened lazily, so a source can be pickled to worker processes.
+
+    Parameters
+    ----------
+    tar_path : str, path to uncompressed .tar file
+    index_file : str, path to saved index, default tar_path + '.idx.npz'
+    extensions : tuple of str, member name endings to index
+
+    Attributes
+    ----------
+    names : Numpy Array of str, member names
+    offsets : Numpy Array of int64, byte offset of each member's data
+    sizes : Numpy Array of int64, byte size of each member
+    """
+
+    def __init__(self, tar_path, index_file=None,
+                 extensions=(".jpg", ".jpeg", ".png")):
+        self.tar_path = tar_path
+        if index_file is None:
+            index_file = tar_path + '.idx.npz'
+        self.index_file = index_file
+        self.extensions = extensions
+
+        self.names = None
+        self.offsets = None
+        self.sizes = None
+        self.lookup = None
+
+        self._f = None
+        self._mm = None
+        self._lock = threading.Lock()
+
+        if not self.load_index():
+            self.build_index()
+            self.save_index()
+
+    def _signature(self):
+        s = os.stat(self.tar_path)
+        return np.array([s.st_size, s.st_mtime_ns], dtype=np.int64)
+
+    def load_index(self):
+        """Load the saved index if it matches the archive
+
+        Returns
+        -------
+        bool, True if loaded
+        """
+        if not os.path.exists(self.index_file):
+            return False
+        with np.load(self.index_file) as npz:
+            if not np.array_equal(npz["signature"], self._signature()):
+                return False
+            self._set_index(npz["names"], npz["offsets"], npz["sizes"])
+        return True
+
+    def build_index(self):
+        """Read the archive headers and record member data offsets"""
+        names, offsets, sizes = [], [], []
+        with tarfile.open(self.tar_path, "r:") as tar:
+            for m in tar:
+                if m.isfile() and m.name.lower().endswith(self.extensions):
+                    names.append(m.name)
+                    offsets.append(m.offset_data)
+                    sizes.append(m.size)
+        self._set_index(np.array(names, dtype=str),
+                        np.array(offsets, dtype=np.int64),
+                        np.array(sizes, dtype=np.int64))
+
+    def save_index(self):
+        tmp = self.index_file + '.tmp.npz'
+        np.savez(tmp, names=self.names, offsets=self.offsets,
+                 sizes=self.sizes, signature=self._signature())
+        os.replace(tmp, self.index_file)
+
+    def _set_index(self, names, offsets, sizes):
+        self.names = names
+        self.offsets = offsets
+        self.sizes = sizes
+        self.lookup = {n: i for i, n in enumerate(names.tolist())}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_f"] = None
+        state["_mm"] = None
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _open(self):
+        with self._lock:
+            if self._f is None:
+                f = open(self.tar_path, 'rb')
+                try:
+                    self._mm = mmap.mmap(f.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+                except (OSError, ValueError, OverflowError):
+                    self._mm = None
+                self._f = f
+
+    def read(self, member):
+        """Bytes of one member
+
+        Parameters
+        ----------
+        member : str, member name as in self.names
+        """
+        i = self.lookup[member]
+        offset = int(self.offsets[i])
+        size = int(self.sizes[i])
+        if self._f is None:
+            self._open()
+        if self._mm is not None:
+            return self._mm[offset:offset + size]
+        with self._lock:
+            self._f.seek(offset)
+            return self._f.read(size)
+
+    def path(self, member):
+        """File path of a member, readable with read_bytes"""
+        return self.tar_path + MEMBER_SEP + member
+
+    def list_files(self, name_fn):
+        """List the images in the archive with their true class names
+
+        Parameters
+        ----------
+        name_fn : callable, returns the class name given the member's
+            folder with os.path.sep separators
+
+        Returns
+        -------
+        list of tuples, (class name, file path) for each image in
+            archive order
+        """
+        files = []
+        for member in self.names.tolist():
+            dir_path = os.path.dirname(member).replace("/", os.path.sep)
+            files.append((name_fn(dir_path), self.path(member)))
+        return files
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+            if self._f is not None:
+                self._f.close()
+                self._f = None
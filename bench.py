@@ -0,0 +1,198 @@
+"""Synthetic data benchmark of the profiling pipeline stages
+
+Runs without the ImageNet Dogs download or network access, using
+deterministic generated JPEGs and a randomly initialized model.
+
+Usage
+-----
+python bench.py --classes 5 --per-class 20 --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+
+
+def make_dataset(directory, n_classes=5, per_class=20, size=(500, 375),
+                 seed=0):
+    """Write deterministic synthetic JPEGs in the Stanford Dogs layout,
+    one folder per class named '<wordnet id>-<class name>'
+
+    Parameters
+    ----------
+    directory : str, path to folder to write images to
+    n_classes : int, number of class folders
+    per_class : int, number of images per class
+    size : tuple of int, (width, height) in pixels
+    seed : int, random seed
+
+    Returns
+    -------
+    directory : str
+    """
+    from PIL import Image
+
+    rs = np.random.RandomState(seed)
+    w, h = size
+    for c in range(n_classes):
+        class_dir = os.path.join(directory, "n{:08d}-class_{}".format(c, c))
+        if not os.path.exists(class_dir):
+            os.makedirs(class_dir)
+        for n in range(per_class):
+            a = rs.randint(0, 256, size=(h, w, 3), dtype=np.uint8)
+            Image.fromarray(a).save(os.path.join(class_dir,
+                                                 "img_{}.jpg".format(n)),
+                                    quality=90)
+    return directory
+
+
+def summarize(seconds, n_items):
+    """Summarize repeated timings of a stage
+
+    Parameters
+    ----------
+    seconds : list of float, seconds for each repeat
+    n_items : int, number of items processed per repeat
+
+    Returns
+    -------
+    dict, total seconds and per item milliseconds statistics
+    """
+    a = np.asarray(seconds, dtype=float)
+    per_item_ms = a / max(n_items, 1) * 1e3
+    return {"repeats": len(a),
+            "n_items": n_items,
+            "total_s": float(a.sum()),
+            "per_item_ms_mean": float(per_item_ms.mean()),
+            "per_item_ms_min": float(per_item_ms.min()),
+            "per_item_ms_max": float(per_item_ms.max())}
+
+
+def time_calls(fn, repeats):
+    """Seconds taken by each of repeats calls to fn"""
+    seconds = []
+    for n in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - t0)
+    return seconds
+
+
+def run(directory, repeats=3, batch_size=8, model=True, n_labels=1000,
+        seed=0):
+    """Benchmark each pipeline stage on a synthetic dataset
+
+    Parameters
+    ----------
+    directory : str, path to synthetic dataset, see make_dataset
+    repeats : int, number of timed repeats of each stage
+    batch_size : int, images per model call
+    model : bool, benchmark a randomly initialized MobileNetV2, which
+        needs Keras but no weights download
+    n_labels : int, number of classes output by the label decode stage
+    seed : int, random seed
+
+    Returns
+    -------
+    dict of dicts, stage name to timing summary
+    """
+    import models
+    import confusion
+    from labels import LabelDecoder
+
+    rs = np.random.RandomState(seed)
+    m = models.ClassifyRegular(batch_size=batch_size)
+    m.weights = None
+    m.labels = LabelDecoder(["class_{}".format(n) for n in range(n_labels)])
+    files = m.list_dataset(directory)
+    stages = {}
+
+    def preprocess():
+        for name, f_path in files:
+            m.prepare(f_path)
+    stages["preprocess"] = summarize(time_calls(preprocess, repeats),
+                                     len(files))
+
+    if model:
+        m.load_model()
+        stages["load_model"] = summarize([m.load_time_s], 1)
+        m.predict_files(files)  # untimed warm up
+        stages["predict"] = summarize(time_calls(lambda: m.predict_files(files),
+                                                 repeats), len(files))
+        stages["predict"]["stage_ms"] = m.timing_report().to_dict()
+
+    scores = rs.rand(len(files), n_labels).astype(np.float32)
+    stages["label_decode"] = summarize(time_calls(
+        lambda: m.labels.decode(scores), repeats), len(files))
+
+    names = [name for name, f_path in files]
+    m.d = {}
+    for name, p_label in zip(names, rs.choice(names, size=len(names))):
+        m.d.setdefault(name, []).append(p_label)
+    m.output_file = None
+    stages["collate_predictions"] = summarize(time_calls(
+        m.collate_predictions, repeats), len(files))
+
+    y = m.df.y_true.values
+    p = m.df.y_pred.values
+    stages["confusion_matrix"] = summarize(time_calls(
+        lambda: confusion.Matrix(y=y, p=p), repeats), len(files))
+    return stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--classes", type=int, default=5,
+                        help="number of synthetic classes")
+    parser.add_argument("--per-class", type=int, default=20,
+                        help="number of images per class")
+    parser.add_argument("--size", type=int, nargs=2, default=(500, 375),
+                        metavar=("WIDTH", "HEIGHT"),
+                        help="synthetic JPEG size in pixels")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-model", action="store_true",
+                        help="skip the Keras model stage")
+    parser.add_argument("--directory", default=None,
+                        help="folder for synthetic images, default temporary")
+    parser.add_argument("--output", default=None,
+                        help="JSON output file, default stdout")
+    args = parser.parse_args(argv)
+
+    directory = args.directory
+    cleanup = directory is None
+    if cleanup:
+        directory = tempfile.mkdtemp(prefix="cnn_profiler_bench_")
+    try:
+        make_dataset(directory, args.classes, args.per_class,
+                     tuple(args.size), args.seed)
+        stages = run(directory, repeats=args.repeats,
+                     batch_size=args.batch_size, model=not args.no_model,
+                     seed=args.seed)
+    finally:
+        if cleanup:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    results = {"config": vars(args),
+               "platform": {"python": platform.python_version(),
+                            "machine": platform.machine(),
+                            "system": platform.system(),
+                            "processor": platform.processor()},
+               "stages": stages}
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2, default=str)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
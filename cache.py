@@ -0,0 +1,296 @@
+"""Persistent cache of preprocessed image arrays in memory-mapped shards"""
+
+import os
+import json
+import time
+import threading
+import numpy as np
+
+import config
+from archive import source_stat
+
+
+class TensorCache:
+    """On disk cache of preprocessed image arrays
+
+    Arrays of the same shape and dtype are written together into .npy
+    shards which are read back with np.load(mmap_mode='r'), so a cache
+    hit is a view into the page cache and not a copy.  A JSON index maps
+    each key to a (shard, row) location.  When the shards exceed
+    max_bytes, the least recently used shards are deleted.
+
+    Parameters
+    ----------
+    directory : str, path to cache folder.  Default None uses
+        'tensor_cache' in config.data_directory
+    max_bytes : int, size limit of all shards in bytes
+    shard_size : int, number of arrays written per shard
+
+    Attributes
+    ----------
+    hits : int, number of get calls served from the cache
+    misses : int, number of get calls not found in the cache
+    """
+
+    def __init__(self, directory=None, max_bytes=8 * 2**30, shard_size=256):
+        if directory is None:
+            directory = config.data_directory + "tensor_cache" + os.path.sep
+        self.directory = os.path.normpath(directory)
+        self.index_file = self.directory + os.path.sep + "index.json"
+        self.max_bytes = max_bytes
+        self.shard_size = shard_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._mmaps = {}
+        self._pending = {}
+        self._pending_keys = {}
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.index = {"entries": {}, "shards": {}, "next_shard": 0}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as f:
+                self.index = json.load(f)
+
+    @staticmethod
+    def key(file_path, h, w, mode):
+        """Cache key for a preprocessed image file
+
+        Parameters
+        ----------
+        file_path : str, path to source image, or archive member,
+            see archive.split_path
+        h : int, pixel height
+        w : int, pixel width
+        mode : str, scaling mode applied to the pixels
+
+        Returns
+        -------
+        str, key that changes when the file is modified
+        """
+        mtime = source_stat(file_path).st_mtime_ns
+        return "{}|{}|{}|{}|{}".format(os.path.abspath(file_path), mtime,
+                                       h, w, mode)
+
+    @property
+    def nbytes(self):
+        """Total size in bytes of all shards on disk"""
+        return sum(s["bytes"] for s in self.index["shards"].values())
+
+    def get(self, key):
+        """Get a cached array
+
+        Parameters
+        ----------
+        key : str, see TensorCache.key
+
+        Returns
+        -------
+        read only Numpy Array view, or None if key is not cached
+        """
+        with self._lock:
+            if key in self._pending_keys:
+                self.hits += 1
+                return self._pending_keys[key]
+            loc = self.index["entries"].get(key)
+            if loc is None:
+                self.misses += 1
+                return None
+            shard, row = loc
+            a = self._mmaps.get(shard)
+            if a is None:
+                a = np.load(self._shard_path(shard), mmap_mode='r')
+                self._mmaps[shard] = a
+            self.index["shards"][shard]["last_used"] = time.time()
+            self.hits += 1
+            return a[row]
+
+    def put(self, key, image_a):
+        """Add an array to the cache, shards are written once shard_size
+        arrays of the same shape and dtype are pending
+
+        Parameters
+        ----------
+        key : str, see TensorCache.key
+        image_a : Numpy Array
+        """
+        layout = (image_a.shape, image_a.dtype.str)
+        with self._lock:
+            pending = self._pending.setdefault(layout, [])
+            pending.append((key, image_a))
+            self._pending_keys[key] = image_a
+            if len(pending) >= self.shard_size:
+                self._write_shard(layout)
+                self.evict()
+                self.save_index()
+
+    def flush(self):
+        """Write all pending arrays to shards and save the index"""
+        with self._lock:
+            for layout in list(self._pending):
+                self._write_shard(layout)
+            self.evict()
+            self.save_index()
+
+    def evict(self):
+        """Delete least recently used shards until under max_bytes"""
+        with self._lock:
+            shards = self.index["shards"]
+            order = sorted(shards, key=lambda k: shards[k]["last_used"])
+            while self.nbytes > self.max_bytes and order:
+                self._remove_shard(order.pop(0))
+
+    def clear(self):
+        """Delete every shard and pending array"""
+        with self._lock:
+            self._pending = {}
+            self._pending_keys = {}
+            for shard in list(self.index["shards"]):
+                self._remove_shard(shard)
+            self.save_index()
+
+    def save_index(self):
+        """Atomically write the index file"""
+        with self._lock:
+            tmp = self.index_file + ".tmp"
+            with open(tmp, 'w') as f:
+                json.dump(self.index, f)
+            os.replace(tmp, self.index_file)
+
+    def _shard_path(self, shard):
+        return self.directory + os.path.sep + shard
+
+    def _write_shard(self, layout):
+        pending = self._pending.pop(layout, [])
+        if len(pending) == 0:
+            return
+        shard = "shard_{:06d}.npy".format(self.index["next_shard"])
+        self.index["next_shard"] += 1
+        a = np.stack([image_a for key, image_a in pending])
+        tmp = self._shard_path(shard) + ".tmp"
+        with open(tmp, 'wb') as f:
+            np.save(f, a)
+        os.replace(tmp, self._shard_path(shard))
+        self.index["shards"][shard] = {"bytes": os.path.getsize(
+                                           self._shard_path(shard)),
+                                       "last_used": time.time()}
+        for row, (key, image_a) in enumerate(pending):
+            self.index["entries"][key] = [shard, row]
+            self._pending_keys.pop(key, None)
+
+    def _remove_shard(self, shard):
+        self._mmaps.pop(shard, None)
+        self.index["shards"].pop(shard, None)
+        entries = self.index["entries"]
+        for key in [k for k, v in entries.items() if v[0] == shard]:
+            del entries[key]
+        try:
+            os.remove(self._shard_path(shard))
+        except OSError:
+            pass  # still mapped by a live view on Windows, orphaned
+
+
+class ModelCache:
+    """On disk cache of built Keras models
+
+    A model is built from its Python definition once, saved with
+    model.save, and loaded with keras.models.load_model, or the loader
+    passed to get_or_build, on later runs.  Keys include the version of
+    the framework that built the model, Keras or tf.keras, and of
+    Tensorflow, so upgrading either builds the model again instead of
+    loading an incompatible file.
+
+    Parameters
+    ----------
+    directory : str, path to cache folder.  Default None uses
+        'model_cache' in config.data_directory
+
+    Attributes
+    ----------
+    hit : bool, whether the last get_or_build call loaded from the cache
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = config.data_directory + "model_cache" + os.path.sep
+        self.directory = os.path.normpath(directory)
+        self.hit = False
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    @staticmethod
+    def key(architecture, input_shape, weights, framework="keras",
+            framework_version=None):
+        """Cache key for a model
+
+        Parameters
+        ----------
+        architecture : str, model name, e.g. 'mobilenet_v2'
+        input_shape : tuple of int, input shape without the batch dimension
+        weights : str, weights the model was built with, None if random
+        framework : str, package that builds the model, e.g. 'keras' or
+            'tf.keras'
+        framework_version : str, version of framework, default None
+            uses keras.__version__ and requires Keras
+
+        Returns
+        -------
+        str, usable as a file name
+        """
+        if framework_version is None:
+            import keras
+            framework_version = keras.__version__
+        try:
+            import tensorflow as tf
+            tf_version = tf.__version__
+        except ImportError:
+            tf_version = "none"
+        return "{}_{}_{}_{}{}_tf{}".format(
+            architecture, "x".join(str(n) for n in input_shape),
+            "random" if weights is None else os.path.basename(str(weights)),
+            framework, framework_version, tf_version)
+
+    def path(self, key):
+        return self.directory + os.path.sep + key + ".h5"
+
+    def get_or_build(self, key, build_fn, custom_objects=None,
+                     load_model=None):
+        """Load a cached model, or build and cache it
+
+        Parameters
+        ----------
+        key : str, see key
+        build_fn : callable, returns the Keras model when called with
+            no arguments
+        custom_objects : dict, passed to load_model
+        load_model : callable, loads a saved model, default None uses
+            keras.models.load_model, e.g. tf.keras.models.load_model
+            for models built with tf.keras
+
+        Returns
+        -------
+        Keras model
+        """
+        if load_model is None:
+            from keras.models import load_model
+
+        fp = self.path(key)
+        if os.path.exists(fp):
+            self.hit = True
+            return load_model(fp, custom_objects=custom_objects,
+                              compile=False)
+        self.hit = False
+        model = build_fn()
+        tmp = fp + ".tmp.h5"
+        model.save(tmp)
+        os.replace(tmp, fp)
+        return model
+
+    def clear(self):
+        """Delete all cached models"""
+        for f in os.listdir(self.directory):
+            if f.endswith(".h5"):
+                os.remove(self.directory + os.path.sep + f)
@@ -0,0 +1,179 @@
+"""Indexed catalog of profiling runs and their artifact files"""
+
+import os
+import time
+import sqlite3
+
+import config
+
+RUN_FIELDS = ["platform", "pu", "pu_type", "tf_version", "run_id"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    name TEXT PRIMARY KEY,
+    platform TEXT,
+    pu TEXT,
+    pu_type TEXT,
+    tf_version TEXT,
+    run_id TEXT,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    name TEXT REFERENCES runs(name) ON DELETE CASCADE,
+    kind TEXT,
+    path TEXT,
+    PRIMARY KEY (name, kind)
+);
+CREATE INDEX IF NOT EXISTS runs_platform ON runs (platform);
+CREATE INDEX IF NOT EXISTS runs_hardware ON runs (pu, pu_type);
+CREATE INDEX IF NOT EXISTS runs_tf_version ON runs (tf_version);
+CREATE INDEX IF NOT EXISTS artifacts_kind ON artifacts (kind);
+"""
+
+
+class RunCatalog:
+    """SQLite catalog of profiling runs
+
+    Each run is registered once with its metadata as separate fields,
+    so no field depends on splitting a filename, and the paths of its
+    artifacts, e.g. 'pstats', 'predictions', 'timings', 'power',
+    'events' and 'stream', the output streamed by predict_files.
+    Relative artifact paths are relative to data_directory.
+
+    Parameters
+    ----------
+    path : str, path to SQLite file, default None uses 'catalog.sqlite'
+        in config.data_directory
+    data_directory : str, folder relative artifact paths are in
+    """
+
+    def __init__(self, path=None, data_directory=config.data_directory):
+        self.data_directory = data_directory
+        if path is None:
+            path = os.path.join(data_directory, "catalog.sqlite")
+        self.path = path
+        if not os.path.exists(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        self.con = sqlite3.connect(path)
+        self.con.execute("PRAGMA foreign_keys = ON")
+        self.con.executescript(SCHEMA)
+
+    def close(self):
+        self.con.close()
+
+    def register(self, name, platform=None, pu=None, pu_type=None,
+                 tf_version=None, run_id=None, **artifacts):
+        """Add or update a run and its artifacts.  Metadata fields left
+        as None keep the values of an earlier registration
+
+        Parameters
+        ----------
+        name : str, unique name of the run, e.g. the profile_name used
+            as the prefix of its files
+        platform : str, e.g. 'win10'
+        pu : str, processing unit, e.g. 'i7'
+        pu_type : str, e.g. 'CPU'
+        tf_version : str, Tensorflow version
+        run_id : str, identifier of the run within the platform
+        **artifacts : str, path of each artifact file by kind
+        """
+        with self.con:
+            self.con.execute("INSERT OR IGNORE INTO runs (name, created) "
+                             "VALUES (?, ?)", (name, time.time()))
+            # fields not passed keep their registered values
+            self.con.execute(
+                "UPDATE runs SET platform = COALESCE(?, platform), "
+                "pu = COALESCE(?, pu), pu_type = COALESCE(?, pu_type), "
+                "tf_version = COALESCE(?, tf_version), "
+                "run_id = COALESCE(?, run_id) WHERE name = ?",
+                (platform, pu, pu_type, tf_version, run_id, name))
+            for kind, path in artifacts.items():
+                if path is not None:
+                    self._add_artifact(name, kind, path)
+
+    def add_artifact(self, name, kind, path):
+        """Add or replace one artifact path of a registered run"""
+        with self.con:
+            self._add_artifact(name, kind, path)
+
+    def _add_artifact(self, name, kind, path):
+        self.con.execute("INSERT OR REPLACE INTO artifacts (name, kind, path) "
+                         "VALUES (?, ?, ?)", (name, kind, path))
+
+    def resolve(self, path):
+        """Absolute path of an artifact"""
+        return os.path.join(self.data_directory, path)
+
+    def runs(self, **where):
+        """Runs matching metadata fields, using the indexes
+
+        Parameters
+        ----------
+        **where : str, value of any field in RUN_FIELDS to match
+
+        Returns
+        -------
+        list of dicts, one per run with its metadata fields and an
+            'artifacts' dict of kind to path
+        """
+        for k in where:
+            if k not in RUN_FIELDS:
+                raise ValueError("Unknown run field: {}".format(k))
+        sql = "SELECT name, {} FROM runs".format(", ".join(RUN_FIELDS))
+        params = []
+        if len(where) > 0:
+            sql += " WHERE " + " AND ".join("{} = ?".format(k) for k in where)
+            params = list(where.values())
+        sql += " ORDER BY name"
+        runs = []
+        for row in self.con.execute(sql, params).fetchall():
+            run = dict(zip(["name"] + RUN_FIELDS, row))
+            run["artifacts"] = dict(self.con.execute(
+                "SELECT kind, path FROM artifacts WHERE name = ?",
+                (run["name"],)).fetchall())
+            runs.append(run)
+        return runs
+
+    def query(self, **where):
+        """Runs matching metadata fields as a Pandas DataFrame, with one
+        column per artifact kind, see runs"""
+        import pandas as pd
+
+        rows = []
+        for run in self.runs(**where):
+            row = {k: v for k, v in run.items() if k != "artifacts"}
+            row.update(run["artifacts"])
+            rows.append(row)
+        return pd.DataFrame(rows, columns=None if rows else
+                            ["name"] + RUN_FIELDS)
+
+    def import_directory(self, data_directory=None):
+        """Register runs found by the legacy filename conventions,
+        'platform_PU_PUtype_TFversion_runid - kind.ext'
+
+        Parameters
+        ----------
+        data_directory : str, folder to scan, default self.data_directory
+
+        Returns
+        -------
+        int, number of runs registered
+        """
+        if data_directory is None:
+            data_directory = self.data_directory
+        kinds = {"pstats": "pstats", "predictions": "predictions",
+                 "power": "power", "profile_output": "events",
+                 "timings": "timings"}
+        found = {}
+        for f in sorted(os.listdir(data_directory)):
+            if " - " not in f:
+                continue
+            name, suffix = f.split(" - ", 1)
+            for key, kind in kinds.items():
+                if key in suffix:
+                    found.setdefault(name, {})[kind] = f
+        for name, artifacts in found.items():
+            fs = name.split("_")
+            meta = dict(zip(RUN_FIELDS, fs[:4] + ["_".join(fs[4:])]))
+            self.register(name, **dict(meta, **artifacts))
+        return len(found)
@@ -0,0 +1,94 @@
+"""Append-only prediction output with checkpoints for resuming runs"""
+
+import os
+import csv
+import json
+
+
+class PredictionWriter:
+    """Stream prediction rows to a CSV file in chunks
+
+    After every chunk is appended and synced to disk, a checkpoint file
+    records the number of rows and bytes written.  On resume, anything
+    after the last checkpoint is truncated, so a crash mid-write never
+    leaves a partial row, and the file paths already written are skipped.
+
+    Parameters
+    ----------
+    file_path : str, path to output CSV file
+    columns : list of str, column names, the first must be 'file_path'
+    chunk_size : int, number of rows buffered before each append
+    resume : bool, continue an existing file instead of overwriting it
+
+    Attributes
+    ----------
+    checkpoint_file : str, path to JSON checkpoint, file_path + '.ckpt'
+    done : set of str, file paths already written when resumed
+    rows : int, number of rows written to disk
+    """
+
+    def __init__(self, file_path, columns, chunk_size=256, resume=False):
+        self.file_path = file_path
+        self.checkpoint_file = file_path + '.ckpt'
+        self.columns = list(columns)
+        self.chunk_size = chunk_size
+
+        self.done = set()
+        self.rows = 0
+        self.buffer = []
+
+        if resume and os.path.exists(self.checkpoint_file):
+            self._resume()
+        else:
+            with open(self.file_path, 'w', newline='') as f:
+                csv.writer(f).writerow(self.columns)
+            self._checkpoint()
+
+    def _resume(self):
+        with open(self.checkpoint_file, 'r') as f:
+            ckpt = json.load(f)
+        if ckpt["columns"] != self.columns:
+            raise ValueError("Columns in {} do not match, cannot resume"
+                             .format(self.file_path))
+        with open(self.file_path, 'r+b') as f:
+            f.truncate(ckpt["bytes"])
+        with open(self.file_path, 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            self.done = set(row[0] for row in reader)
+        self.rows = ckpt["rows"]
+
+    def _checkpoint(self):
+        ckpt = {"rows": self.rows,
+                "bytes": os.path.getsize(self.file_path),
+                "columns": self.columns}
+        tmp = self.checkpoint_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(ckpt, f)
+        os.replace(tmp, self.checkpoint_file)
+
+    def write(self, rows):
+        """Buffer rows, appending them to disk once chunk_size are held
+
+        Parameters
+        ----------
+        rows : list of lists, values in the same order as columns
+        """
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Append buffered rows, sync them to disk and checkpoint"""
+        if len(self.buffer) == 0:
+            return
+        with open(self.file_path, 'a', newline='') as f:
+            csv.writer(f).writerows(self.buffer)
+            f.flush()
+            os.fsync(f.fileno())
+        self.rows += len(self.buffer)
+        self.buffer = []
+        self._checkpoint()
+
+    def close(self):
+        self.flush()
@@ -1,12 +1,61 @@
 """Simple Client to sent events 
 Colin Dietrich 2019"""
 
+import json
+import time
+import queue
 import socket
 import atexit
+import threading
 
 import config
 
 
+def encode_event(m, mono=None, wall=None):
+	"""Frame an event as one line of JSON, timestamped at the source
+
+	Parameters
+	----------
+	m : str, event message
+	mono : float, monotonic clock seconds, default now
+	wall : float, wall clock seconds since the epoch, default now
+
+	Returns
+	-------
+	bytes, newline terminated UTF-8 JSON
+	"""
+	if mono is None:
+		mono = time.monotonic()
+	if wall is None:
+		wall = time.time()
+	return (json.dumps({"m": m, "mono": mono, "wall": wall}) +
+			"\n").encode('utf-8')
+
+
+def decode_event(line):
+	"""Parse a line framed by encode_event
+
+	Parameters
+	----------
+	line : bytes or str, one framed event
+
+	Returns
+	-------
+	dict with keys 'm', 'mono' and 'wall'.  Unframed text from older
+		clients is returned as the message with None timestamps
+	"""
+	if isinstance(line, bytes):
+		line = line.decode('utf-8')
+	line = line.strip()
+	try:
+		event = json.loads(line)
+	except ValueError:
+		event = None
+	if not isinstance(event, dict) or "m" not in event:
+		return {"m": line, "mono": None, "wall": None}
+	return event
+
+
 class Telemetry:
 	def __init__(self, server_ip):
 		
@@ -20,10 +69,154 @@ class Telemetry:
 		atexit.register(self.s.close)
 
 	def send(self, m, verbose=False):
-		self.s.send(m.encode('utf-8'))
+		"""Send a message as one newline terminated line, so the
+		server can tell consecutive messages apart"""
+		self.s.sendall((m + "\n").encode('utf-8'))
 
 	def recv(self):
 		return self.s.recv(config.buffer_size)
+
+
+class AsyncTelemetry:
+	"""Telemetry client that never blocks the caller on the network
+
+	Events are timestamped in send, put in a bounded queue and written
+	in batches by a background thread, framed by encode_event.  If the
+	queue is full the event is dropped and counted rather than waiting.
+	Send failures close the socket and reconnect after reconnect_delay,
+	keeping the unsent batch.
+
+	Parameters
+	----------
+	server_ip : str, IP address of event server
+	server_port : int, port of event server, default config.server_port
+	max_events : int, maximum number of queued events
+	batch_size : int, maximum number of events written per send
+	flush_interval : float, seconds to wait for more events before
+		writing a partial batch
+	reconnect_delay : float, seconds between reconnect attempts
+	"""
+	def __init__(self, server_ip, server_port=None, max_events=10000,
+				 batch_size=64, flush_interval=0.05, reconnect_delay=1.0):
+
+		self.server_ip = server_ip
+		self.server_port = server_port
+		if server_port is None:
+			self.server_port = config.server_port
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.reconnect_delay = reconnect_delay
+		self.s = None
+
+		self.q = queue.Queue(maxsize=max_events)
+		self.stop_event = threading.Event()
+		self.thread = None
+
+		self.n_events = 0
+		self.n_sent = 0
+		self.n_dropped = 0
+		self.n_reconnects = 0
+		self.overhead_s = 0.0
+		self.overhead_max_s = 0.0
+
+	def connect(self):
+		"""Start the background sender thread, which connects"""
+		self.stop_event.clear()
+		self.thread = threading.Thread(target=self._run, daemon=True)
+		self.thread.start()
+		atexit.register(self.close)
+
+	def send(self, m, verbose=False):
+		"""Timestamp and queue an event without blocking
+
+		Parameters
+		----------
+		m : str, event message
+		verbose : bool, print event
+		"""
+		t0 = time.perf_counter()
+		mono = time.monotonic()
+		wall = time.time()
+		try:
+			self.q.put_nowait((m, mono, wall))
+			self.n_events += 1
+		except queue.Full:
+			self.n_dropped += 1
+		dt = time.perf_counter() - t0
+		self.overhead_s += dt
+		self.overhead_max_s = max(self.overhead_max_s, dt)
+		if verbose:
+			print(m, mono, wall)
+
+	def stats(self):
+		"""Event counts and the time send adds to the caller
+
+		Returns
+		-------
+		dict of event counts, mean and max overhead per event in seconds
+		"""
+		n = self.n_events + self.n_dropped
+		return {"events": self.n_events,
+				"sent": self.n_sent,
+				"dropped": self.n_dropped,
+				"queued": self.q.qsize(),
+				"reconnects": self.n_reconnects,
+				"overhead_mean_s": self.overhead_s / n if n > 0 else 0.0,
+				"overhead_max_s": self.overhead_max_s}
+
+	def close(self, timeout=5.0):
+		"""Flush queued events and stop the sender thread
+
+		Parameters
+		----------
+		timeout : float, seconds to wait for the flush
+		"""
+		self.stop_event.set()
+		if self.thread is not None:
+			self.thread.join(timeout)
+			self.thread = None
+		if self.s is not None:
+			self.s.close()
+			self.s = None
+
+	def _connect(self):
+		s = socket.create_connection((self.server_ip, self.server_port),
+									 timeout=self.reconnect_delay)
+		s.settimeout(None)
+		return s
+
+	def _next_batch(self):
+		batch = []
+		try:
+			batch.append(self.q.get(timeout=self.flush_interval))
+			while len(batch) < self.batch_size:
+				batch.append(self.q.get_nowait())
+		except queue.Empty:
+			pass
+		return batch
+
+	def _run(self):
+		batch = []
+		while True:
+			if len(batch) == 0:
+				if self.stop_event.is_set() and self.q.empty():
+					break
+				batch = self._next_batch()
+				if len(batch) == 0:
+					continue
+			try:
+				if self.s is None:
+					self.s = self._connect()
+				self.s.sendall(b"".join(encode_event(*e) for e in batch))
+				self.n_sent += len(batch)
+				batch = []
+			except OSError:
+				if self.s is not None:
+					self.s.close()
+					self.s = None
+				self.n_reconnects += 1
+				if self.stop_event.wait(self.reconnect_delay):
+					break
 		
 if __name__ == "__main__":
 	import time
@@ -8,6 +8,7 @@ download_directory = (cwd + os.path.sep +
 				      os.path.normpath("downloads") + os.path.sep)
 images_directory = (download_directory + os.path.sep + 
 				    os.path.normpath("Images") + os.path.sep)
+images_archive = download_directory + "images.tar"
 
 server_ip = '192.168.86.47'
 server_port = 5005
@@ -4,79 +4,130 @@
 """
 
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 
 class Matrix:
     """Calculate a Confusion Matrix
 
+    Counts are accumulated with np.bincount over integer class codes, so
+    the matrix can also be built incrementally with update during
+    streaming inference.  Classes are the sorted unique values of y and p
+    seen so far, so a batch may predict a class whose true images have
+    not been added yet.
+
     Parameters
     ----------
-    y : array-like, true labels
+    y : array-like, true labels, or None to start empty
     p : array-like, predicted labels of same type and length as y
+    sparse : bool, store counts in a scipy.sparse matrix, for large
+        numbers of classes
 
     Attributes
     ----------
-    y : see above
-    p : see above
-    df : Pandas DataFrame, aligned y and p data
-    dfg : Pandas DataFrame, grouped by (y, p) combinations and counts
-    a : Numpy array, confusion matrix values
+    y : Numpy Array, class codes of the last true labels added
+    p : Numpy Array, class codes of the last predicted labels added
+    labels : Numpy Array, class label for each code
+    counts : Numpy Array or scipy.sparse matrix, int64 confusion matrix,
+        rows are true classes, columns are predicted classes
+    a : Numpy Array or scipy.sparse matrix, confusion matrix values
     df_cm : Pandas DataFrame, confusion matrix values with row/column labels
     """
 
-    def __init__(self, y, p):
-
-        assert type(y) == type(p)
-        assert len(y) == len(p)
+    def __init__(self, y=None, p=None, sparse=False):
 
+        self.sparse = sparse
         self.categorical = False
-        if isinstance(y[0], str):
-            self.categorical = True
-
-        if self.categorical:
-            from sklearn import preprocessing
-            le = preprocessing.LabelEncoder()
-            le.fit(y)
-            y = le.transform(y)
-            p = le.transform(p)
-
-        self.y = y
-        self.p = p
-
-        self.df = pd.DataFrame({'y':self.y, 'p':self.p})
-        self.n_classes = len(self.df.y.unique())
-
-        self.labels = range(self.n_classes)
-        if self.categorical:
-            self.labels = le.inverse_transform(self.labels)
+        self.labels = None
+        self.n_classes = 0
+        self.counts = self._zeros(0)
+        self.y = None
+        self.p = None
 
-        self.a = np.zeros((self.n_classes, self.n_classes))
+        self.cmap = 'Greens'
 
-        self.dfg = self.df.groupby(['p','y']).size().reset_index().rename(columns={0:'n'})
-        _ = self.dfg.apply(lambda x: self.assemble_cm(x), axis=1)
+        if y is not None:
+            assert type(y) == type(p)
+            self.update(y, p)
 
-        self.df_cm = pd.DataFrame(self.a, self.labels, self.labels)
+    def _zeros(self, n):
+        if self.sparse:
+            from scipy import sparse
+            return sparse.csr_matrix((n, n), dtype=np.int64)
+        return np.zeros((n, n), dtype=np.int64)
 
-        self.cmap = 'Greens'
+    def _add_labels(self, y):
+        """Grow the sorted class labels to include y, remapping counts
 
-    def assemble_cm(self, row):
-        """Assemble a confusion matrix
+        Parameters
+        ----------
+        y : Numpy Array, labels
+        """
+        if self.labels is None:
+            new_labels = np.unique(y)
+        else:
+            new_labels = np.union1d(self.labels, y)
+        if len(new_labels) == self.n_classes:
+            return
+        counts = self._zeros(len(new_labels))
+        if self.n_classes > 0:
+            pos = np.searchsorted(new_labels, self.labels)
+            if self.sparse:
+                from scipy import sparse
+                c = self.counts.tocoo()
+                counts = sparse.csr_matrix((c.data, (pos[c.row], pos[c.col])),
+                                           shape=counts.shape)
+            else:
+                counts[np.ix_(pos, pos)] = self.counts
+        self.labels = new_labels
+        self.n_classes = len(new_labels)
+        self.counts = counts
+
+    def encode(self, x):
+        """Class codes of labels x, which must already be in self.labels"""
+        return np.searchsorted(self.labels, np.asarray(x))
+
+    def update(self, y, p):
+        """Add true and predicted labels to the confusion matrix
 
         Parameters
         ----------
-        row : row in a Pandas DataFrame with columns 'y_true', 'y_pred', 'count'
-            'y_true' = true value of input data sample
-            'y_pred' = predicted value of input data sample
-            'n' = number of times this prediction combination occurred
-        a : numpy array, filled with zeros of shape n x n where n is the number
-            of unique classes in the whole input data set
+        y : array-like, true labels
+        p : array-like, predicted labels of same type and length as y
         """
-        y = row.y
-        p = row.p
-        self.a[y, p] = self.a[y, p] + row.n
+        assert len(y) == len(p)
+        y = np.asarray(y)
+        p = np.asarray(p)
+        if len(y) == 0:
+            return
+        if isinstance(y[0], str):
+            self.categorical = True
+
+        self._add_labels(np.concatenate([y, p]))
+        self.y = self.encode(y)
+        self.p = self.encode(p)
+
+        n = self.n_classes
+        if self.sparse:
+            from scipy import sparse
+            self.counts = self.counts + sparse.csr_matrix(
+                (np.ones(len(y), dtype=np.int64), (self.y, self.p)),
+                shape=(n, n))
+        else:
+            self.counts += np.bincount(self.y * n + self.p,
+                                       minlength=n * n).reshape(n, n)
+
+    @property
+    def a(self):
+        return self.counts.astype(float)
+
+    @property
+    def df_cm(self):
+        import pandas as pd
+
+        if self.sparse:
+            return pd.DataFrame.sparse.from_spmatrix(self.a, self.labels,
+                                                     self.labels)
+        return pd.DataFrame(self.a, self.labels, self.labels)
 
     def plot(self, font_scale=1.4, axis_labels=True, ticklabels=False, 
              figsize=5, **kwargs):
@@ -90,6 +141,8 @@ class Matrix:
         figsize : float, size in inches to make square confusion matrix
         **kwargs : keyword arguments to pass to seaborn.heatmap method
         """
+        import matplotlib.pyplot as plt
+        import seaborn as sns
 
         xticklabels=False
         yticklabels=False
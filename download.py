@@ -4,11 +4,46 @@
 """
 
 import os
+import time
+import hashlib
 import requests
 import tarfile
+from concurrent import futures
 
 import config
 
+# pinned digests in sha256sum format, see download_all
+SHA256_FILE = "SHA256SUMS"
+
+
+def file_sha256(fp, chunk_size=2**20):
+    """Hex SHA-256 of a file"""
+    h = hashlib.sha256()
+    with open(fp, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_digests(fp):
+    """Read a sha256sum format file as a dict of file name to digest"""
+    digests = {}
+    if os.path.exists(fp):
+        with open(fp, 'r') as f:
+            for line in f:
+                if line.strip():
+                    digest, name = line.strip().split(None, 1)
+                    digests[name.lstrip('*')] = digest.lower()
+    return digests
+
+
+def write_digests(fp, digests):
+    """Write a dict of file name to digest in sha256sum format"""
+    with open(fp, 'w') as f:
+        for name in sorted(digests):
+            f.write('{}  {}\n'.format(digests[name], name))
+
+
 class Download():
     def __init__(self, data_url, data_directory):
         self.data_directory = data_directory
@@ -30,29 +65,112 @@ class Download():
             os.makedirs(config.download_directory)
         
     @staticmethod
-    def download_data(d_url, d_directory, verbose=False):
+    def download_data(d_url, d_directory, verbose=False, sha256=None,
+                      chunk_size=2**20, timeout=30):
         """Download data to local directory
 
+        The file is streamed in chunks to '<file>.part', resuming from
+        the end of an earlier partial download with an HTTP Range
+        request, and only renamed into place once complete and verified.
+
         Parameters
         ----------
         d_directory : str, path to directory to save file
         d_url : str, URL to download file
+        verbose : bool, print progress and throughput
+        sha256 : str, expected hex SHA-256 of the file, a mismatch
+            deletes the partial file and raises ValueError.  An existing
+            file is checked too
+        chunk_size : int, bytes read per chunk
+        timeout : float, seconds to wait for the server
+
+        Returns
+        -------
+        bool, True if the file was downloaded, False if it already existed
         """
         if verbose:
                 print('Downloading data from %s...' % d_url)
         d_file = d_url.split("/")[-1]
         d_file_target = os.path.normpath(d_directory + os.path.sep + d_file)
-        if not os.path.exists(d_file_target):
-            res = requests.get(d_url)
-            with open(d_file_target, "wb") as f:
-                f.write(res.content)
-            if verbose:
-                print('Data is located in %s' % d_directory)
-            return True
-        else:
+        if os.path.exists(d_file_target):
             print('Download file already exists in {}'.format(d_directory))
+            if (sha256 is not None and
+                    file_sha256(d_file_target) != sha256.lower()):
+                raise ValueError('Checksum mismatch for existing {}'
+                                 .format(d_file_target))
             return False
 
+        part = d_file_target + '.part'
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        h = hashlib.sha256()
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        with requests.get(d_url, stream=True, headers=headers,
+                          timeout=timeout) as res:
+            if res.status_code == 416:
+                # nothing left to fetch, the partial file is complete
+                total = offset
+            else:
+                res.raise_for_status()
+                if res.status_code != 206:
+                    offset = 0
+                length = int(res.headers.get('Content-Length', 0))
+                total = offset + length if length else None
+                if res.headers.get('Content-Encoding', 'identity') != 'identity':
+                    total = None  # length is of the encoded body
+            if offset:
+                with open(part, 'rb') as f:
+                    for chunk in iter(lambda: f.read(chunk_size), b''):
+                        h.update(chunk)
+            if res.status_code != 416:
+                n = Download._stream(res, part, offset, total, h, chunk_size,
+                                     verbose)
+                if total is not None and n != total:
+                    # the partial file is kept, so the next call resumes
+                    raise IOError('Download of {} ended at {} of {} bytes'
+                                  .format(d_file, n, total))
+
+        if sha256 is not None and h.hexdigest() != sha256.lower():
+            os.remove(part)
+            raise ValueError('Checksum mismatch for {}, expected {} got {}'
+                             .format(d_file, sha256, h.hexdigest()))
+        os.replace(part, d_file_target)
+        if verbose:
+            print('Data is located in %s' % d_directory)
+        return True
+
+    @staticmethod
+    def _stream(res, part, offset, total, h, chunk_size, verbose):
+        """Append a streamed response to part, updating hash h
+
+        Returns
+        -------
+        int, size of part in bytes
+        """
+        n = offset
+        t0 = time.perf_counter()
+        t_print = t0
+        with open(part, 'ab' if offset else 'wb') as f:
+            for chunk in res.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                h.update(chunk)
+                n += len(chunk)
+                t = time.perf_counter()
+                if verbose and (t - t_print > 1.0):
+                    t_print = t
+                    Download._progress(n, offset, total, t - t0)
+        if verbose:
+            Download._progress(n, offset, total, time.perf_counter() - t0)
+        return n
+
+    @staticmethod
+    def _progress(n, offset, total, dt):
+        rate = (n - offset) / dt / 2**20 if dt > 0 else 0.0
+        if total:
+            print('{:.1f} of {:.1f} MB ({:.0%}), {:.2f} MB/s'.format(
+                  n / 2**20, total / 2**20, n / total, rate))
+        else:
+            print('{:.1f} MB, {:.2f} MB/s'.format(n / 2**20, rate))
+
     @staticmethod
     def extract_files(d_file, d_directory=".", verbose=False):
         """Extract tar or tar.gz archive files
@@ -75,35 +193,75 @@ class Download():
             if verbose:
                 print("Files extracted successfully to {}".format(d_directory))
 
-    def extract(self, verbose=False):
-        if self.download_data(self.data_url, self.data_directory, verbose):
+    def extract(self, verbose=False, sha256=None):
+        if self.download_data(self.data_url, self.data_directory, verbose,
+                              sha256=sha256):
             self.extract_files(self.data_file_target, self.data_directory, verbose)
             print('Files extracted to {}'.format(self.data_file_target))
         else:
             print('File archive already extracted')
 
         
-def download_all():
+def download_all(max_workers=4, extract=True):
+    """Download the model, labels and images
+
+    Parameters
+    ----------
+    max_workers : int, number of files downloaded at once
+    extract : bool, extract the images archive, if False it is indexed
+        instead so it can be read in place, see archive.TarImageSource
+    """
     import config
     directory = config.download_directory
 
-    # TPU model file and ImageNet labels
     d = Download("","")
-    d.download_data(d_url="https://storage.googleapis.com/cloud-iot-edge-pretrained-models/canned_models/mobilenet_v2_1.0_224_quant_edgetpu.tflite",
-                    d_directory=directory, verbose=True)
-    d.download_data(d_url="http://storage.googleapis.com/cloud-iot-edge-pretrained-models/canned_models/imagenet_labels.txt",
-                    d_directory=directory, verbose=True)
-    # simple test image
-    d.download_data(d_url="https://upload.wikimedia.org/wikipedia/commons/a/a9/Female_German_Shepherd.jpg",
-                    d_directory=directory, verbose=True)
+    urls = [# TPU model file and ImageNet labels
+            "https://storage.googleapis.com/cloud-iot-edge-pretrained-models/canned_models/mobilenet_v2_1.0_224_quant_edgetpu.tflite",
+            # same model compiled for CPU, see models.ClassifyTFLite
+            "https://storage.googleapis.com/cloud-iot-edge-pretrained-models/canned_models/mobilenet_v2_1.0_224_quant.tflite",
+            "http://storage.googleapis.com/cloud-iot-edge-pretrained-models/canned_models/imagenet_labels.txt",
+            # simple test image
+            "https://upload.wikimedia.org/wikipedia/commons/a/a9/Female_German_Shepherd.jpg"]
     # Images for ImageNet ID
-    if not os.path.exists(config.images_directory):
+    d_images = None
+    if not extract:
+        urls.append('http://vision.stanford.edu/aditya86/ImageNetDogs/images.tar')
+    elif not os.path.exists(config.images_directory):
         print('Extracted Images not found, downloading...')
         url = 'http://vision.stanford.edu/aditya86/ImageNetDogs/images.tar'
         d_images = Download(data_url=url, data_directory=directory)
-        d_images.extract(verbose=True)
     else:
         print('Extracted ImageNet Dog Images found, skipping download.')
+
+    # files are checked against digests pinned by the first download,
+    # copy a trusted SHA256SUMS into the download directory to pin them
+    # before any download
+    sha256_file = os.path.join(directory, SHA256_FILE)
+    digests = read_digests(sha256_file)
+
+    def name(url):
+        return url.split("/")[-1]
+
+    # independent files are fetched concurrently
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        jobs = [executor.submit(d.download_data, d_url=u, d_directory=directory,
+                                verbose=True, sha256=digests.get(name(u)))
+                for u in urls]
+        if d_images is not None:
+            urls.append(d_images.data_url)
+            jobs.append(executor.submit(d_images.extract, verbose=True,
+                                        sha256=digests.get(d_images.data_file)))
+        for job in jobs:
+            job.result()
+
+    for u in urls:
+        fp = os.path.join(directory, name(u))
+        if name(u) not in digests and os.path.exists(fp):
+            digests[name(u)] = file_sha256(fp)
+    write_digests(sha256_file, digests)
+    if not extract:
+        from archive import TarImageSource
+        TarImageSource(config.images_archive)
     print('Done!')
     
 if __name__ == "__main__":
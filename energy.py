@@ -0,0 +1,257 @@
+"""Vectorized energy integration over power trace windows"""
+
+import numpy as np
+
+
+def to_ns(t):
+    """Convert datetime-like or float seconds to int64 nanoseconds
+
+    Parameters
+    ----------
+    t : scalar or array-like, datetime64, Timestamps or float seconds
+
+    Returns
+    -------
+    Numpy Array of int64 nanoseconds, at least 1 dimensional
+    """
+    import pandas as pd
+
+    a = np.atleast_1d(np.asarray(t))
+    if a.dtype.kind == 'O' or a.dtype.kind == 'M':
+        return np.asarray(pd.to_datetime(a).values,
+                          dtype='datetime64[ns]').astype(np.int64)
+    return np.round(a.astype(float) * 1e9).astype(np.int64)
+
+
+def integrate_windows(t, watts, t0, t1, rule='trapezoid'):
+    """Integrate power over many time windows in one vectorized call
+
+    Samples strictly inside each window (t0, t1) are used.  Cumulative
+    sums of energy, power and sample counts are built once, so each
+    window costs two searchsorted lookups.
+
+    Parameters
+    ----------
+    t : array-like, sorted sample times, datetime64 or float seconds
+    watts : array-like, power at each sample time
+    t0 : scalar or array-like, start time of each window
+    t1 : scalar or array-like, end time of each window
+    rule : str, 'trapezoid' integrates between samples in the window,
+        'rectangle' multiplies each sample by the time since the
+        previous sample, as calc_W_h always has
+
+    Returns
+    -------
+    Pandas DataFrame, one row per window with columns:
+        energy_J : float, Joules consumed in window
+        W_h : float, Watt-hours consumed in window
+        duration : Timedelta, time between first and last sample
+        W_mean : float, mean power of samples in window
+        W_max : float, max power in window
+        W_min : float, min power in window
+        W_mean_off : float, mean power of samples before t0 or after
+            t1 (idle)
+        n_samples : int, number of samples in window
+    """
+    import pandas as pd
+
+    if rule not in ('trapezoid', 'rectangle'):
+        raise ValueError("rule must be 'trapezoid' or 'rectangle', not {}"
+                         .format(rule))
+    t_ns = to_ns(t)
+    w = np.asarray(watts, dtype=float)
+    t0_ns = to_ns(t0)
+    t1_ns = to_ns(t1)
+    n = len(w)
+
+    # seconds from first sample keeps float precision for long traces
+    ts = (t_ns - t_ns[0]) / 1e9 if n > 0 else t_ns.astype(float)
+    dts = np.diff(ts)
+
+    i0 = np.searchsorted(t_ns, t0_ns, side='right')
+    i1 = np.maximum(np.searchsorted(t_ns, t1_ns, side='left'), i0)
+    n_in = i1 - i0
+
+    w_cum = np.concatenate([[0.0], np.cumsum(w)])
+    if rule == 'rectangle':
+        e = np.concatenate([[0.0], w[1:] * dts]) if n > 0 else w
+        e_cum = np.concatenate([[0.0], np.cumsum(e)])
+        energy = e_cum[i1] - e_cum[i0]
+    else:
+        e = (w[1:] + w[:-1]) / 2 * dts
+        e_cum = np.concatenate([[0.0, 0.0], np.cumsum(e)])
+        energy = np.where(n_in > 1, e_cum[i1] - e_cum[np.minimum(i0 + 1, n)],
+                          0.0)
+
+    # samples at exactly t0 or t1 are neither in nor outside a window
+    j0 = np.searchsorted(t_ns, t0_ns, side='left')
+    j1 = np.searchsorted(t_ns, t1_ns, side='right')
+    n_off = j0 + n - j1
+    w_off = w_cum[j0] + w_cum[-1] - w_cum[j1]
+
+    w_in = w_cum[i1] - w_cum[i0]
+    has = n_in > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w_mean = np.where(has, w_in / n_in, np.nan)
+        w_mean_off = np.where(n_off > 0, w_off / n_off, np.nan)
+
+    # reduceat over interleaved [i0, i1) pairs, padded so i1 == n is valid
+    idx = np.column_stack([np.minimum(i0, n), i1]).ravel()
+    w_pad = np.concatenate([w, [np.nan]])
+    if len(idx) > 0:
+        w_max = np.where(has, np.maximum.reduceat(w_pad, idx)[::2], np.nan)
+        w_min = np.where(has, np.minimum.reduceat(w_pad, idx)[::2], np.nan)
+    else:
+        w_max = w_min = np.zeros(0)
+
+    last = np.maximum(i1 - 1, 0)
+    first = np.minimum(i0, max(n - 1, 0))
+    duration = np.where(has, t_ns[last] - t_ns[first], 0) if n > 0 else \
+        np.zeros(len(i0), dtype=np.int64)
+
+    return pd.DataFrame({"energy_J": energy,
+                         "W_h": energy / (60 * 60),
+                         "duration": pd.to_timedelta(duration, unit='ns'),
+                         "W_mean": w_mean,
+                         "W_max": w_max,
+                         "W_min": w_min,
+                         "W_mean_off": w_mean_off,
+                         "n_samples": n_in})
+
+
+def energy_between(t, watts, t0, t1):
+    """Energy between arbitrary times, including windows shorter than
+    the power sampling interval
+
+    The trapezoidal cumulative energy at each sample is linearly
+    interpolated at the window edges, so a window between two samples
+    gets its share of the interval energy.
+
+    Parameters
+    ----------
+    t : array-like, sorted sample times, datetime64 or float seconds
+    watts : array-like, power at each sample time
+    t0 : scalar or array-like, start time of each window
+    t1 : scalar or array-like, end time of each window
+
+    Returns
+    -------
+    Numpy Array, Joules consumed in each window
+    """
+    t_ns = to_ns(t)
+    w = np.asarray(watts, dtype=float)
+    ts = (t_ns - t_ns[0]) / 1e9
+    e_cum = np.concatenate([[0.0], np.cumsum((w[1:] + w[:-1]) / 2 *
+                                             np.diff(ts))])
+    e0 = np.interp((to_ns(t0) - t_ns[0]) / 1e9, ts, e_cum)
+    e1 = np.interp((to_ns(t1) - t_ns[0]) / 1e9, ts, e_cum)
+    return e1 - e0
+
+
+class ClockFit:
+    """Linear map from host clock seconds to power meter clock seconds,
+    ref = host + offset + drift * (host - host_origin)
+
+    Parameters
+    ----------
+    offset : float, seconds added to host time at host_origin
+    drift : float, seconds of meter clock gained per host second
+    host_origin : float, host time the fit is centered on
+
+    Attributes
+    ----------
+    residual_s : Numpy Array, fit residual of each sync marker in seconds
+    """
+
+    def __init__(self, offset=0.0, drift=0.0, host_origin=0.0):
+        self.offset = offset
+        self.drift = drift
+        self.host_origin = host_origin
+        self.residual_s = np.zeros(0)
+
+    def to_ref(self, host):
+        """Convert host clock seconds to meter clock seconds"""
+        host = np.asarray(host, dtype=float)
+        return host + self.offset + self.drift * (host - self.host_origin)
+
+
+def fit_clock(host, ref, drift=True):
+    """Estimate the clock offset and drift between host and power meter
+    from sync markers seen by both
+
+    Parameters
+    ----------
+    host : array-like, host clock seconds of each sync marker, e.g. the
+        'wall' timestamp set by client.AsyncTelemetry
+    ref : array-like, meter clock seconds of the same markers, e.g. the
+        'recv_wall' time logged by server.EventServer on the meter host
+    drift : bool, fit drift as well as offset, needs 2 or more markers
+
+    Returns
+    -------
+    ClockFit, least squares fit.  Network latency between sending and
+        logging a marker is included in the offset
+    """
+    host = np.asarray(host, dtype=float)
+    ref = np.asarray(ref, dtype=float)
+    if len(host) == 0:
+        raise ValueError("At least one sync marker is needed")
+    origin = host.mean()
+    d = ref - host
+    if drift and len(host) > 1 and np.ptp(host) > 0:
+        slope, offset = np.polyfit(host - origin, d, 1)
+    else:
+        slope, offset = 0.0, d.mean()
+    fit = ClockFit(offset=offset, drift=slope, host_origin=origin)
+    fit.residual_s = ref - fit.to_ref(host)
+    return fit
+
+
+def attribute_energy(df, df_timings, t, watts, clock=None, idle_watts=None):
+    """Attribute power trace energy to each classified image
+
+    Each image is given the energy used during the model call of its
+    batch, split evenly between the images in the batch.
+
+    Parameters
+    ----------
+    df : Pandas DataFrame, predictions with a 'file_path' column, see
+        models.ImageClassifier.collate_predictions
+    df_timings : Pandas DataFrame, per-image timings with 'file_path',
+        'wall_start' and 'wall_end' columns, see
+        models.ImageClassifier.save_timings
+    t : array-like, sorted power sample times, datetime64 on the meter
+        clock
+    watts : array-like, power at each sample time
+    clock : ClockFit, host to meter clock map, default None assumes
+        the clocks agree, see fit_clock
+    idle_watts : float, idle baseline power, if given the energy above
+        it is returned as column 'energy_net_J'
+
+    Returns
+    -------
+    Pandas DataFrame, df joined on file_path with columns 'energy_J',
+        't0' and 't1' (meter clock datetime64) and optionally
+        'energy_net_J'
+    """
+    import pandas as pd
+
+    if clock is None:
+        clock = ClockFit()
+    wall = df_timings[["wall_start", "wall_end"]].values.astype(float)
+    ref = clock.to_ref(wall)
+    t0 = pd.to_datetime(ref[:, 0], unit='s').values
+    t1 = pd.to_datetime(ref[:, 1], unit='s').values
+    e = energy_between(t, watts, t0, t1)
+
+    # images in the same batch share one model call window
+    _, inverse, counts = np.unique(wall[:, 0], return_inverse=True,
+                                   return_counts=True)
+    e_image = e / counts[inverse.ravel()]
+
+    _df = pd.DataFrame({"file_path": df_timings.file_path.values,
+                        "energy_J": e_image, "t0": t0, "t1": t1})
+    if idle_watts is not None:
+        _df["energy_net_J"] = (e_image - idle_watts * (ref[:, 1] - ref[:, 0]) /
+                               counts[inverse.ravel()])
+    return df.merge(_df, on="file_path", how="left")
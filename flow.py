@@ -3,15 +3,40 @@
 Colin Dietrich 2019
 """
 
+import os
+import numpy as np
 
-from keras.preprocessing.image import ImageDataGenerator
+from manifest import DatasetManifest
 
 
 class ImageFlow:
-    def __init__(self, d_directory, **kwargs):
+    """Training, validation and test image generators for one folder
+    of class subfolders
+
+    The folder is listed once, see manifest.DatasetManifest, and the
+    listing split per class and shared by all three generators through
+    flow_from_dataframe.  Each generator is created on first use.
+
+    Parameters
+    ----------
+    d_directory : str, path to folder with one subfolder per class
+    batch_size : int, images per batch
+    img_height : int, pixel height images are resized to
+    img_width : int, pixel width images are resized to
+    workers : int, number of workers loading batches in parallel,
+        see batches
+    max_queue_size : int, number of batches prefetched by the workers
+    use_multiprocessing : bool, workers are processes instead of threads
+    seed : int, random seed for shuffling and augmentation
+    **kwargs : keyword arguments passed to the training ImageDataGenerator
+    """
+
+    def __init__(self, d_directory, batch_size=10, img_height=128,
+                 img_width=128, workers=4, max_queue_size=10,
+                 use_multiprocessing=False, seed=None, **kwargs):
         self.d_directory = d_directory
-        self.img_height = 128
-        self.img_width = 128
+        self.img_height = img_height
+        self.img_width = img_width
         self.shear_range = 0.2
         self.zoom_range = 0.2
         self.horizontal_flip = False
@@ -19,60 +44,141 @@ class ImageFlow:
         self.validation_split = 0.2
         self.fillmode = 'nearest'
 
-        self.seed = None
-        self.batch_size = 10
+        self.seed = seed
+        self.batch_size = batch_size
         self.class_mode = 'categorical'
 
-        train_datagen = ImageDataGenerator(rescale=1./255,
-                                           shear_range=self.shear_range,
-                                           zoom_range=self.zoom_range,
-                                           horizontal_flip=self.horizontal_flip,
-                                           vertical_flip=self.vertical_flip,
-                                           validation_split=0.2,  # percent of images used for validation
-                                           **kwargs)
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.use_multiprocessing = use_multiprocessing
 
-        self.train_generator = train_datagen.flow_from_directory(
-            self.d_directory,
-            target_size=(self.img_height, self.img_width),
-            batch_size=self.batch_size,
-            class_mode=self.class_mode,
-            seed=self.seed,
-            subset='training')  # set as training data
+        self.kwargs = kwargs
+        self._index = None
+        self._generators = {}
+        self.enqueuers = []
 
-        self.validation_generator = train_datagen.flow_from_directory(
-            self.d_directory,  # same directory as training data
-            target_size=(self.img_height, self.img_width),
-            batch_size=self.batch_size,
-            class_mode=self.class_mode,
-            seed=self.seed,
-            subset='validation')  # set as validation data
-        
-        test_datagen = ImageDataGenerator(rescale=1./255)
-        self.test_generator = test_datagen.flow_from_directory(
-            self.d_directory,
+    @property
+    def index(self):
+        """Pandas DataFrame of all images with columns 'filename',
+        'class' (folder name) and 'subset' ('training' or 'validation')"""
+        import pandas as pd
+
+        if self._index is None:
+            m = DatasetManifest.open(self.d_directory, os.path.basename)
+            df = pd.DataFrame({"filename": [f for c, f in m.files()],
+                               "class": m.class_names[m.class_id]})
+            # like flow_from_directory, the first validation_split of
+            # each class's sorted files are held out for validation
+            rank = df.groupby("class").cumcount().values
+            counts = df["class"].map(df["class"].value_counts()).values
+            n_val = (counts * self.validation_split).astype(int)
+            df["subset"] = np.where(rank < n_val, "validation", "training")
+            self._index = df
+        return self._index
+
+    @property
+    def classes(self):
+        return sorted(self.index["class"].unique())
+
+    def _flow(self, datagen, df, shuffle=True):
+        return datagen.flow_from_dataframe(
+            df, x_col="filename", y_col="class",
             target_size=(self.img_height, self.img_width),
+            classes=self.classes,
             batch_size=self.batch_size,
             class_mode=self.class_mode,
             seed=self.seed,
-            shuffle=False)
-        
+            shuffle=shuffle)
+
+    def _train_datagen(self):
+        from keras.preprocessing.image import ImageDataGenerator
+
+        return ImageDataGenerator(rescale=1./255,
+                                  shear_range=self.shear_range,
+                                  zoom_range=self.zoom_range,
+                                  horizontal_flip=self.horizontal_flip,
+                                  vertical_flip=self.vertical_flip,
+                                  **self.kwargs)
+
+    def _generator(self, name):
+        from keras.preprocessing.image import ImageDataGenerator
+
+        if name not in self._generators:
+            df = self.index
+            if name == "test":
+                g = self._flow(ImageDataGenerator(rescale=1./255), df,
+                               shuffle=False)
+            else:
+                g = self._flow(self._train_datagen(), df[df.subset == name])
+            self._generators[name] = g
+        return self._generators[name]
+
+    @property
+    def train_generator(self):
+        return self._generator("training")
+
+    @property
+    def validation_generator(self):
+        return self._generator("validation")
+
+    @property
+    def test_generator(self):
+        return self._generator("test")
+
+    def batches(self, img_generator):
+        """Batches of a generator loaded in parallel by self.workers,
+        in order, with up to self.max_queue_size batches prefetched
+
+        Parameters
+        ----------
+        img_generator : keras Sequence, e.g. self.train_generator
+
+        Returns
+        -------
+        generator yielding (images, labels) batches without end,
+            stopped by close
+        """
+        from keras.utils import OrderedEnqueuer
+
+        enqueuer = OrderedEnqueuer(img_generator,
+                                   use_multiprocessing=self.use_multiprocessing)
+        enqueuer.start(workers=self.workers,
+                       max_queue_size=self.max_queue_size)
+        self.enqueuers.append(enqueuer)
+        return enqueuer.get()
+
+    def close(self):
+        """Stop the workers started by batches"""
+        for enqueuer in self.enqueuers:
+            enqueuer.stop()
+        self.enqueuers = []
+
     @staticmethod
     def display_images(img_generator, n=15, cols=5):
+        """Plot n images as the generator would transform them, loading
+        only those n images"""
         import math
-        import numpy as np
         import matplotlib.pyplot as plt
+        from keras.preprocessing.image import load_img, img_to_array
+
         class_mapper = {v: k for k, v in img_generator.class_indices.items()}
 
+        n = min(n, img_generator.n)
+        if img_generator.shuffle:
+            idx = np.random.RandomState(img_generator.seed).choice(
+                img_generator.n, n, replace=False)
+        else:
+            idx = np.arange(n)
+        datagen = img_generator.image_data_generator
+
         rows = int(math.ceil(n / cols))
         plt.figure(figsize=(cols * 3, rows * 3))
-        i = 0
-        while True:
-            a = next(img_generator)
-            for j, image_array in enumerate(a[0]):  # image arrays
-                if i == n:
-                    return plt.show()
-                plt.subplot(rows, cols, i + 1)
-                plt.axis('off')
-                plt.imshow(image_array)
-                plt.title(class_mapper[np.argmax(a[1][j])])
-                i += 1
\ No newline at end of file
+        for i, j in enumerate(idx):
+            x = img_to_array(load_img(img_generator.filepaths[j],
+                                      target_size=img_generator.target_size))
+            x = datagen.standardize(datagen.random_transform(x))
+            plt.subplot(rows, cols, i + 1)
+            plt.axis('off')
+            plt.imshow(x)
+            plt.title(class_mapper[img_generator.classes[j]])
+        return plt.show()
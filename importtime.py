@@ -0,0 +1,140 @@
+"""Cold start import time of each package module
+
+Each module is imported in a fresh interpreter, so the time includes
+everything it pulls in.  Where Python supports '-X importtime' (3.7+)
+the heaviest imports behind each module are listed too.
+
+Usage
+-----
+python importtime.py --repeats 5 client models --output importtime.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+MODULES = ["config", "client", "server", "labels", "timing", "pipeline",
+           "cache", "checkpoint", "archive", "manifest", "catalog", "energy",
+           "confusion", "parse", "download", "models", "flow", "bench"]
+
+# prints the seconds taken by the import on the last line of stdout
+_SNIPPET = ("import time; t0 = time.perf_counter(); import {}; "
+            "print(time.perf_counter() - t0)")
+
+
+def parse_importtime(stderr):
+    """Parse '-X importtime' output
+
+    Parameters
+    ----------
+    stderr : str, output of an interpreter run with '-X importtime'
+
+    Returns
+    -------
+    dict, imported module name to cumulative microseconds
+    """
+    us = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # header row
+        us[fields[2].strip()] = int(fields[1])
+    return us
+
+
+def time_import(module, importtime=True, cwd=None):
+    """Import one module in a new interpreter
+
+    Parameters
+    ----------
+    module : str, module name
+    importtime : bool, also record '-X importtime' output
+    cwd : str, folder to run in, default the folder of this file
+
+    Returns
+    -------
+    seconds : float, time taken by the import statement
+    us : dict, imported module name to cumulative microseconds, empty
+        if importtime is False
+    """
+    if cwd is None:
+        cwd = os.path.dirname(os.path.abspath(__file__))
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", _SNIPPET.format(module)]
+    r = subprocess.run(cmd, cwd=cwd, stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE, universal_newlines=True)
+    if r.returncode != 0:
+        raise ImportError(r.stderr.strip().splitlines()[-1])
+    seconds = float(r.stdout.strip().splitlines()[-1])
+    return seconds, parse_importtime(r.stderr) if importtime else {}
+
+
+def run(modules=MODULES, repeats=3, top=10):
+    """Cold start import time of each module
+
+    Parameters
+    ----------
+    modules : list of str, module names
+    repeats : int, number of fresh interpreters per module
+    top : int, number of heaviest imports listed per module
+
+    Returns
+    -------
+    dict of dicts, module name to timing summary, or to an 'error'
+        if it can't be imported
+    """
+    importtime = sys.version_info >= (3, 7)
+    results = {}
+    for module in modules:
+        seconds = []
+        us = {}
+        try:
+            for n in range(repeats):
+                s, _us = time_import(module, importtime)
+                seconds.append(s)
+                for k, v in _us.items():
+                    us[k] = min(v, us.get(k, v))
+        except ImportError as e:
+            results[module] = {"error": str(e)}
+            continue
+        ms = np.asarray(seconds) * 1e3
+        heaviest = sorted(((k, v) for k, v in us.items() if k != module),
+                          key=lambda kv: kv[1], reverse=True)[:top]
+        results[module] = {"repeats": repeats,
+                           "import_ms_min": float(ms.min()),
+                           "import_ms_mean": float(ms.mean()),
+                           "import_ms_max": float(ms.max()),
+                           "top_cumulative_ms": [(k, v / 1e3)
+                                                 for k, v in heaviest]}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("modules", nargs="*", default=MODULES,
+                        help="modules to time, default all")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10,
+                        help="number of heaviest imports listed per module")
+    parser.add_argument("--output", default=None,
+                        help="JSON output file, default stdout")
+    args = parser.parse_args(argv)
+
+    results = run(args.modules, repeats=args.repeats, top=args.top)
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
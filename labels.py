@@ -0,0 +1,106 @@
+"""Vectorized class id to label decoding shared by all model backends"""
+
+import json
+import numpy as np
+
+IMAGENET_CLASS_INDEX_URL = ("https://storage.googleapis.com/"
+                            "download.tensorflow.org/data/"
+                            "imagenet_class_index.json")
+
+
+def normalize_label(label):
+    """Format a label string the same way for every backend"""
+    return label.strip().replace('_', ' ').lower()  # be consistent!
+
+
+class LabelDecoder:
+    """Decode model scores to labels using an array built once
+
+    Parameters
+    ----------
+    labels : list of str, label for each class id, in class id order
+
+    Attributes
+    ----------
+    names : Numpy Array of str, normalized label indexed by class id
+    """
+
+    def __init__(self, labels):
+        self.names = np.array([normalize_label(x) for x in labels])
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, ids):
+        return self.names[ids]
+
+    @classmethod
+    def from_imagenet(cls):
+        """Build from the Keras ImageNet class index, downloaded once
+        to the Keras cache folder"""
+        from keras.utils.data_utils import get_file
+        fpath = get_file('imagenet_class_index.json',
+                         IMAGENET_CLASS_INDEX_URL,
+                         cache_subdir='models',
+                         file_hash='c2c37ea517e94d9795004a39431a14cb')
+        with open(fpath, 'r') as f:
+            class_index = json.load(f)
+        return cls([class_index[str(n)][1] for n in range(len(class_index))])
+
+    @classmethod
+    def from_label_file(cls, file_path, missing='other'):
+        """Build from an EdgeTPU style label file, with lines formatted
+        as a 4 character class id, a space, then comma separated names
+
+        Parameters
+        ----------
+        file_path : str, path to label file
+        missing : str, label used for ids not in the file
+        """
+        d = {}
+        with open(file_path, 'r') as f:
+            for line in f:
+                if len(line.strip()) == 0:
+                    continue
+                num = line[:4].strip()
+                d[int(num)] = line[5:].strip().split(',')[0].lower()
+        labels = [d.get(n, missing) for n in range(max(d) + 1)]
+        return cls(labels)
+
+    @staticmethod
+    def top_k(scores, k=1):
+        """Top k class ids and scores for a batch of model outputs
+
+        Parameters
+        ----------
+        scores : Numpy Array, shape (n_images, n_classes)
+        k : int, number of classes to return per image
+
+        Returns
+        -------
+        ids : Numpy Array of int, shape (n_images, k), highest score first
+        top_scores : Numpy Array, shape (n_images, k)
+        """
+        scores = np.asarray(scores)
+        rows = np.arange(len(scores))[:, None]
+        if k == 1:
+            ids = np.argmax(scores, axis=1)[:, None]
+        else:
+            ids = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            order = np.argsort(-scores[rows, ids], axis=1)
+            ids = ids[rows, order]
+        return ids, scores[rows, ids]
+
+    def decode(self, scores):
+        """Top 1 label for each image in a batch of model outputs
+
+        Parameters
+        ----------
+        scores : Numpy Array, shape (n_images, n_classes)
+
+        Returns
+        -------
+        list of str, one label per image
+        """
+        ids, _ = self.top_k(scores, k=1)
+        return self.names[ids[:, 0]].tolist()
@@ -0,0 +1,195 @@
+"""Persisted dataset manifest with stratified subsampling"""
+
+import os
+import numpy as np
+
+from archive import TarImageSource, MEMBER_SEP
+
+
+class DatasetManifest:
+    """Image files of a dataset with their classes, in compact arrays
+
+    A folder dataset, one subfolder per class, is walked once and the
+    manifest saved in it as '.manifest.npz'.  It is rebuilt when any
+    class folder's modification time changes, i.e. a file was added or
+    removed.  An archive dataset is read from its saved member index,
+    see archive.TarImageSource.
+
+    Paths are stored relative to the dataset with '/' separators and
+    sorted, so the same dataset gives the same manifest and subsamples
+    on every platform.  Only each class's folder is saved, class names
+    are given by the name_fn of each caller when the manifest is opened.
+
+    Parameters
+    ----------
+    dataset_path : str, path to folder or uncompressed .tar archive
+    paths : Numpy Array of str, relative path of each image
+    class_id : Numpy Array of int32, class of each image
+    class_dirs : Numpy Array of str, relative folder of each class id
+    sizes : Numpy Array of int64, byte size of each image
+    name_fn : callable, returns the class name given a class folder,
+        default None uses the relative folder as the name
+
+    Attributes
+    ----------
+    class_names : Numpy Array of str, class name of each class id
+    """
+
+    file_name = ".manifest.npz"
+
+    def __init__(self, dataset_path, paths, class_id, class_dirs, sizes,
+                 name_fn=None):
+        self.dataset_path = dataset_path
+        self.paths = paths
+        self.class_id = class_id
+        self.class_dirs = class_dirs
+        self.sizes = sizes
+        if name_fn is None:
+            self.class_names = class_dirs
+        else:
+            self.class_names = np.array([name_fn(self.dir_path(d))
+                                         for d in class_dirs.tolist()],
+                                        dtype=str)
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def is_archive(self):
+        return self.dataset_path.endswith(".tar")
+
+    def dir_path(self, class_dir):
+        """Folder of a class as passed to name_fn, the full path for a
+        folder dataset or the member folder for an archive"""
+        class_dir = class_dir.replace("/", os.path.sep)
+        if self.is_archive:
+            return class_dir
+        return os.path.normpath(os.path.join(self.dataset_path, class_dir))
+
+    @classmethod
+    def open(cls, dataset_path, name_fn, rebuild=False):
+        """Load the saved manifest of a dataset, building it if needed
+
+        Parameters
+        ----------
+        dataset_path : str, path to folder or uncompressed .tar archive
+        name_fn : callable, returns the class name given an image's
+            folder, e.g. ImageClassifier.name_from_directory
+        rebuild : bool, rebuild even if the saved manifest is current
+
+        Returns
+        -------
+        DatasetManifest
+        """
+        if dataset_path.endswith(".tar"):
+            return cls.from_archive(dataset_path, name_fn)
+        dataset_path = os.path.normpath(dataset_path)
+        manifest_file = os.path.join(dataset_path, cls.file_name)
+        signature = cls._signature(dataset_path)
+        if not rebuild and os.path.exists(manifest_file):
+            with np.load(manifest_file) as npz:
+                if ("class_dirs" in npz.files and
+                        np.array_equal(npz["dirs"], signature[0]) and
+                        np.array_equal(npz["mtimes"], signature[1])):
+                    return cls(dataset_path, npz["paths"], npz["class_id"],
+                               npz["class_dirs"], npz["sizes"], name_fn)
+        m = cls.from_directory(dataset_path, name_fn)
+        try:
+            m.save(manifest_file, signature)
+        except OSError:
+            pass  # read only dataset, rebuilt on each run
+        return m
+
+    @staticmethod
+    def _signature(dataset_path):
+        """Names and modification times of the class folders"""
+        dirs = sorted(e.name for e in os.scandir(dataset_path) if e.is_dir())
+        mtimes = [os.stat(os.path.join(dataset_path, d)).st_mtime_ns
+                  for d in dirs]
+        return np.array(dirs, dtype=str), np.array(mtimes, dtype=np.int64)
+
+    @classmethod
+    def from_directory(cls, dataset_path, name_fn=None):
+        """Build a manifest by walking a folder of class subfolders"""
+        paths, dirs, sizes = [], [], []
+        ddf = list(os.walk(dataset_path))
+        for dirpath, dirnames, filenames in ddf[1:]:
+            rel = os.path.relpath(dirpath, dataset_path).replace(os.path.sep,
+                                                                 "/")
+            for f_name in filenames:
+                paths.append(rel + "/" + f_name)
+                dirs.append(rel)
+                sizes.append(os.path.getsize(os.path.join(dirpath, f_name)))
+        return cls._from_lists(dataset_path, paths, dirs, sizes, name_fn)
+
+    @classmethod
+    def from_archive(cls, tar_path, name_fn=None):
+        """Build a manifest from the member index of a .tar archive"""
+        source = TarImageSource(tar_path)
+        members = source.names.tolist()
+        dirs = [p.rsplit("/", 1)[0] if "/" in p else "" for p in members]
+        return cls._from_lists(tar_path, members, dirs,
+                               source.sizes.tolist(), name_fn)
+
+    @classmethod
+    def _from_lists(cls, dataset_path, paths, dirs, sizes, name_fn):
+        paths = np.array(paths, dtype=str)
+        order = np.argsort(paths, kind="mergesort")
+        class_dirs, class_id = np.unique(np.array(dirs, dtype=str),
+                                         return_inverse=True)
+        return cls(dataset_path, paths[order],
+                   class_id.ravel()[order].astype(np.int32),
+                   class_dirs, np.array(sizes, dtype=np.int64)[order],
+                   name_fn)
+
+    def save(self, manifest_file, signature):
+        tmp = manifest_file + ".tmp.npz"
+        np.savez(tmp, paths=self.paths, class_id=self.class_id,
+                 class_dirs=self.class_dirs, sizes=self.sizes,
+                 dirs=signature[0], mtimes=signature[1])
+        os.replace(tmp, manifest_file)
+
+    def subsample(self, per_class, seed=0):
+        """Deterministic stratified sample of images
+
+        Parameters
+        ----------
+        per_class : int, number of images from each class, classes
+            with fewer images are included whole
+        seed : int, random seed, the same seed gives the same sample
+
+        Returns
+        -------
+        Numpy Array of int, sorted indices of the sampled images
+        """
+        rs = np.random.RandomState(seed)
+        idx = []
+        for c in range(len(self.class_dirs)):
+            members = np.flatnonzero(self.class_id == c)
+            idx.append(members[rs.permutation(len(members))[:per_class]])
+        if len(idx) == 0:
+            return np.zeros(0, dtype=int)
+        return np.sort(np.concatenate(idx))
+
+    def file_path(self, rel_path):
+        if self.is_archive:
+            return self.dataset_path + MEMBER_SEP + rel_path
+        return os.path.normpath(self.dataset_path + os.path.sep + rel_path)
+
+    def files(self, idx=None):
+        """List image files with their true class names
+
+        Parameters
+        ----------
+        idx : array-like of int, indices of images, default None lists all
+
+        Returns
+        -------
+        list of tuples, (class name, file path) for each image,
+            see ImageClassifier.list_dataset
+        """
+        if idx is None:
+            idx = np.arange(len(self.paths))
+        names = self.class_names[self.class_id[idx]].tolist()
+        return [(name, self.file_path(p))
+                for name, p in zip(names, self.paths[idx].tolist())]
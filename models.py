@@ -14,23 +14,99 @@ image : image data
 image_array : numpy array of image data
 """
 
+import io
 import os
+import time
+import itertools
+import functools
 import numpy as np
-import pandas as pd
-from keras.preprocessing.image import load_img, img_to_array
-from keras.applications import imagenet_utils
 
 import config
-from client import Telemetry
+from client import Telemetry, AsyncTelemetry
+from pipeline import Prefetcher
+from cache import TensorCache, ModelCache
+from timing import StageTimer, now_ns, confidence_interval
+from labels import LabelDecoder, normalize_label
+from checkpoint import PredictionWriter
+from archive import read_bytes
+from manifest import DatasetManifest
+
+
+def load_image_timed(file_path, h, w, to_array=False, expand=False,
+                     scale=False):
+    """Load and convert JPG image file to Numpy Array, module level
+    so it can be sent to worker processes, see ImageClassifier.preprocess
+
+    Returns
+    -------
+    image_a : PIL Image or Numpy Array
+    stage_ns : tuple of int, nanoseconds spent on (read, decode, scale)
+    """
+    from keras.preprocessing.image import load_img, img_to_array
+    from keras.applications import imagenet_utils
+
+    t0 = now_ns()
+    image_bytes = read_bytes(file_path)
+    t1 = now_ns()
+    image_a = load_img(io.BytesIO(image_bytes), target_size=(h, w))
+    t2 = now_ns()
+    if to_array:
+        image_a = img_to_array(image_a)
+    if expand:
+        image_a = np.expand_dims(image_a, axis=0)
+    if scale:
+        image_a = imagenet_utils.preprocess_input(image_a, mode="tf")
+    t3 = now_ns()
+    return image_a, (t1 - t0, t2 - t1, t3 - t2)
+
+
+def load_image(file_path, h, w, to_array=False, expand=False, scale=False):
+    """Load and convert JPG image file to Numpy Array, see load_image_timed"""
+    return load_image_timed(file_path, h, w, to_array=to_array,
+                            expand=expand, scale=scale)[0]
+
+
+# attributes copied to each worker by predict_dataset_sharded, where set
+SHARD_SETTINGS = ("h", "w", "batch_size", "prepare_kwargs", "prefetch",
+                  "prefetch_workers", "telemetry_sync_every", "labels",
+                  "weights", "model_cache", "label_file", "model_file",
+                  "num_threads")
+
+
+def predict_shard(cls, settings, load_kwargs, files, kwargs):
+    """Load a model and predict one shard of files in a worker process,
+    see ImageClassifier.predict_dataset_sharded
+
+    Returns
+    -------
+    p_labels : list of str, predicted label for each file in order
+    timings : timing.StageTimer, stage timings for each file
+    load_s : float, seconds to load the model
+    predict_s : float, seconds to predict all files
+    """
+    m = cls()
+    for k, v in settings.items():
+        setattr(m, k, v)
+    t0 = time.perf_counter()
+    m.load_model(**load_kwargs)
+    t1 = time.perf_counter()
+    m.predict_files(files, **kwargs)
+    t2 = time.perf_counter()
+    p_iters = {name: iter(v) for name, v in m.d.items()}
+    p_labels = [next(p_iters[name]) for name, f_path in files]
+    return p_labels, m.timings, t1 - t0, t2 - t1
+
 
 class ImageClassifier:
-    def __init__(self):
+    def __init__(self, batch_size=1):
 
         self.model = None
 
         self.h = 224
         self.w = 224
         self.depth_multiplier = 1.0
+        self.batch_size = batch_size
+        self.prepare_kwargs = {}
         self.d = None
         self.df = None
 
@@ -39,6 +115,23 @@ class ImageClassifier:
         
         self.telemetry = None
         self.telemetry_enable = False
+        self.telemetry_sync_every = 0
+
+        self.prefetch = 0
+        self.prefetch_workers = 2
+        self.prefetch_pool = 'thread'
+        self.pipeline_stats = None
+
+        self.cache = None
+        self.model_cache = None
+        self.load_time_s = None
+
+        self.files = None
+        self.manifest = None
+        self.timings = None
+        self.output_file = None
+        self.shard_stats = None
+        self.benchmark_stats = None
 
     @staticmethod
     def name_from_directory(dir_path, verbose=False):
@@ -64,17 +157,185 @@ class ImageClassifier:
         Returns
         -------
         img_a : Numpy Array of shape (h, w, 3)
+
+        When a cache is enabled, array outputs are read from it as
+        read only memory-mapped views, see enable_cache
+        """
+        return self.preprocess_timed(file_path, to_array=to_array,
+                                     expand=expand, scale=scale)[0]
+
+    def preprocess_timed(self, file_path, to_array=False, expand=False,
+                         scale=False):
+        """Preprocess and time the read, decode and scale stages,
+        see preprocess for parameters
+
+        Returns
+        -------
+        img_a : Numpy Array of shape (h, w, 3)
+        stage_ns : tuple of int, nanoseconds spent on (read, decode, scale),
+            a cache hit is counted as read time
         """
-        image_a = load_img(file_path, target_size=(self.h, self.w))
-        if to_array:
-            image_a = img_to_array(image_a)
+        if self.cache is None or not (to_array or expand or scale):
+            return load_image_timed(file_path, self.h, self.w,
+                                    to_array=to_array, expand=expand,
+                                    scale=scale)
+        t0 = now_ns()
+        mode = "{}_{}".format("tf" if scale else "none",
+                              "float" if to_array else "raw")
+        key = self.cache.key(file_path, self.h, self.w, mode)
+        image_a = self.cache.get(key)
+        if image_a is None:
+            image_a, stage_ns = load_image_timed(file_path, self.h, self.w,
+                                                 to_array=to_array,
+                                                 expand=True, scale=scale)
+            image_a = image_a[0]
+            self.cache.put(key, image_a)
+        else:
+            stage_ns = (now_ns() - t0, 0, 0)
         if expand:
             image_a = np.expand_dims(image_a, axis=0)
-        if scale:
-            image_a = imagenet_utils.preprocess_input(image_a, mode="tf")
-        return image_a
+        return image_a, stage_ns
+
+    def enable_cache(self, directory=None, max_bytes=8 * 2**30):
+        """Cache preprocessed arrays on disk so repeat runs skip JPEG decode
+
+        Parameters
+        ----------
+        directory : str, path to cache folder.  Default None uses
+            'tensor_cache' in config.data_directory
+        max_bytes : int, size limit of the cache in bytes
+        """
+        self.cache = TensorCache(directory=directory, max_bytes=max_bytes)
+
+    def enable_model_cache(self, directory=None):
+        """Save the built model on the first load_model call and load
+        the saved file on later runs, see cache.ModelCache
+
+        Parameters
+        ----------
+        directory : str, path to cache folder.  Default None uses
+            'model_cache' in config.data_directory
+        """
+        self.model_cache = ModelCache(directory=directory)
+
+    def build_model(self, architecture, build_fn, weights=None,
+                    load_model=None, framework="keras",
+                    framework_version=None):
+        """Build a Keras model, through the model cache if enabled
+
+        Parameters
+        ----------
+        architecture : str, model name used in the cache key
+        build_fn : callable, returns the model when called with no
+            arguments
+        weights : str, weights used in the cache key
+        load_model : callable, loads a cached model, see
+            cache.ModelCache.get_or_build
+        framework : str, package build_fn uses, see cache.ModelCache.key
+        framework_version : str, version of framework
+
+        Returns
+        -------
+        Keras model
+        """
+        if self.model_cache is None:
+            return build_fn()
+        key = self.model_cache.key(architecture, (self.h, self.w, 3), weights,
+                                   framework, framework_version)
+        return self.model_cache.get_or_build(key, build_fn,
+                                             load_model=load_model)
+
+    def prepare(self, file_path):
+        """Load one image file as a single model input, without the
+        batch dimension, using the preprocess options in
+        self.prepare_kwargs
+
+        Returns
+        -------
+        image_a : model input
+        stage_ns : tuple of int, see preprocess_timed
+        """
+        return self.preprocess_timed(file_path, **self.prepare_kwargs)
+
+    def prepare_function(self, pool):
+        """Function used by the prefetch stage to prepare each file
 
-    def predict_dataset(self, dataset_path, verbose=False):
+        Parameters
+        ----------
+        pool : str, 'thread' or 'process'
+
+        Returns
+        -------
+        callable, taking one file path.  Worker processes can't share
+            the loaded model, so they get the module level load_image_timed
+        """
+        if pool == 'process':
+            return functools.partial(load_image_timed, h=self.h, w=self.w,
+                                     **self.prepare_kwargs)
+        return self.prepare
+
+    def run_model(self, inputs):
+        """Run the model on a batch of prepared inputs
+
+        Parameters
+        ----------
+        inputs : list of model inputs returned by prepare
+
+        Returns
+        -------
+        raw model output for the batch, passed to decode_outputs
+        """
+        return [self.predict(image_a) for image_a in inputs]
+
+    def decode_outputs(self, outputs):
+        """Decode raw model output from run_model to top 1 labels"""
+        return outputs
+
+    def predict_inputs(self, inputs):
+        """Predict top 1 label for each prepared input
+
+        Parameters
+        ----------
+        inputs : list of model inputs returned by prepare
+
+        Returns
+        -------
+        list of str, predicted labels in the same order as inputs
+        """
+        return self.decode_outputs(self.run_model(inputs))
+
+    def list_dataset(self, dataset_path, verbose=False, per_class=None,
+                     seed=0):
+        """List the image files of a dataset with their true class names
+
+        The listing is saved as a manifest, so the dataset is only
+        walked again when it changes, see manifest.DatasetManifest
+
+        Parameters
+        ----------
+        dataset_path : str, path to folder containing images
+            assuming it contains subfolders for each class
+            and that the folder is named for the class, or to an
+            uncompressed .tar archive of that folder, which is read
+            without extracting it, see archive.TarImageSource
+        verbose : bool, print debug statements
+        per_class : int, list a stratified sample of this many images
+            per class, default None lists all images
+        seed : int, random seed of the sample
+
+        Returns
+        -------
+        list of tuples, (class name, file path) for each image
+        """
+        self.manifest = DatasetManifest.open(
+            dataset_path, lambda d: self.name_from_directory(d, verbose))
+        idx = None
+        if per_class is not None:
+            idx = self.manifest.subsample(per_class, seed)
+        return self.manifest.files(idx)
+
+    def predict_dataset(self, dataset_path, verbose=False, per_class=None,
+                        seed=0, **kwargs):
         """Predict top 1 label for each image in directory_path
 
         Parameters
@@ -83,6 +344,10 @@ class ImageClassifier:
             assuming it contains subfolders for each class
             and that the folder is named for the class
         verbose : bool, print debug statements
+        per_class : int, predict a stratified sample of this many images
+            per class, see list_dataset
+        seed : int, random seed of the sample
+        **kwargs : keyword arguments passed to predict_files
 
         Returns
         -------
@@ -90,23 +355,328 @@ class ImageClassifier:
             the list is of class predictions for each image in
             directory_path
         """
+        files = self.list_dataset(dataset_path, verbose, per_class=per_class,
+                                  seed=seed)
+        self.predict_files(files, **kwargs)
+
+    def predict_files(self, files, batch_size=None, prefetch=None,
+                      workers=None, pool=None, output_file=None,
+                      resume=False, chunk_size=256):
+        """Predict top 1 label for each image file
+
+        Parameters
+        ----------
+        files : list of tuples, (class name, file path) for each image,
+            see list_dataset
+        batch_size : int, number of images sent to the model per call,
+            images are grouped across class folders.  Default None
+            uses self.batch_size
+        prefetch : int, number of images decoded ahead of the model
+            by a worker pool, 0 decodes inline.  Default None uses
+            self.prefetch
+        workers : int, number of decode workers.  Default None uses
+            self.prefetch_workers
+        pool : str, 'thread' or 'process'.  Default None uses
+            self.prefetch_pool
+        output_file : str, path to a CSV file that predictions and stage
+            timings are streamed to in chunks instead of held in self.d,
+            see checkpoint.PredictionWriter
+        resume : bool, skip images already in output_file as of its
+            last checkpoint
+        chunk_size : int, number of rows written to output_file at once
+
+        Predictions are stored in self.d, a dict of lists where keys are
+        the true class names.  Timing of the decode stall versus
+        inference is stored in self.pipeline_stats, per-image stage
+        timings in self.timings
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        if prefetch is None:
+            prefetch = self.prefetch
+        if workers is None:
+            workers = self.prefetch_workers
+        if pool is None:
+            pool = self.prefetch_pool
+        if self.cache is not None:
+            pool = 'thread'  # cache hits are mmap views shared by threads
 
-        ddf = list(os.walk(os.path.normpath(dataset_path)))
         self.d = {}
+        self.output_file = output_file
+        writer = None
+        if output_file is not None:
+            writer = PredictionWriter(output_file,
+                                      ["file_path", "y_true", "y_pred"] +
+                                      ["{}_ns".format(stage) for stage
+                                       in StageTimer(0).stages] +
+                                      ["wall_start", "wall_end"],
+                                      chunk_size=chunk_size, resume=resume)
+            files = [f for f in files if f[1] not in writer.done]
+        else:
+            for name, f_path in files:
+                self.d.setdefault(name, [])
+        self.files = files
+        self.timings = StageTimer(len(files))
+        prefetcher = Prefetcher(self.prepare_function(pool),
+                                [f_path for name, f_path in files],
+                                depth=prefetch, workers=workers, pool=pool)
+        inputs_iter = iter(prefetcher)
+        inference_s = 0.0
         if self.telemetry_enable:
             print('>> Telemetry Enabled')
             self.telemetry.send("profile_start")
-        for dirpath, dirnames, filenames in ddf[1:]:
-            name = self.name_from_directory(dirpath, verbose)
-            predicted_labels = []
-            for f_name in filenames:
-                f_path = os.path.normpath(dirpath + os.path.sep + f_name)
-                p_label = self.predict_file(f_path)
-                predicted_labels.append(p_label)
-            self.d[name] = predicted_labels
+        t_start = time.perf_counter()
+        for n in range(0, len(files), batch_size):
+            batch = files[n:n + batch_size]
+            if (self.telemetry_enable and self.telemetry_sync_every and
+                    (n // batch_size) % self.telemetry_sync_every == 0):
+                self.telemetry.send("sync {}".format(n))
+            inputs = []
+            for i, (image_a, stage_ns) in enumerate(
+                    itertools.islice(inputs_iter, len(batch))):
+                self.timings.ns[n + i, :3] = stage_ns
+                inputs.append(image_a)
+            w0 = time.time()
+            t0 = now_ns()
+            outputs = self.run_model(inputs)
+            t1 = now_ns()
+            w1 = time.time()
+            p_labels = self.decode_outputs(outputs)
+            t2 = now_ns()
+            rows = slice(n, n + len(batch))
+            self.timings.wall[rows] = (w0, w1)
+            self.timings.add(rows, "model", (t1 - t0) // len(batch))
+            self.timings.add(rows, "label", (t2 - t1) // len(batch))
+            inference_s += (t2 - t0) / 1e9
+            if writer is None:
+                for (name, f_path), p_label in zip(batch, p_labels):
+                    self.d[name].append(p_label)
+            else:
+                writer.write([[f_path, name, p_label] + ns.tolist() +
+                              wall.tolist()
+                              for (name, f_path), p_label, ns, wall
+                              in zip(batch, p_labels, self.timings.ns[rows],
+                                     self.timings.wall[rows])])
+        if writer is not None:
+            writer.close()
+        total_s = time.perf_counter() - t_start
         if self.telemetry_enable:
             print('>> Telemetry Done')
             self.telemetry.send("profile_end")
+        self.pipeline_stats = {"n_images": len(files),
+                               "load_s": self.load_time_s,
+                               "total_s": total_s,
+                               "decode_stall_s": prefetcher.stall_s,
+                               "inference_s": inference_s,
+                               "stall_fraction": (prefetcher.stall_s / total_s
+                                                  if total_s > 0 else 0.0)}
+        if self.cache is not None:
+            self.cache.flush()
+
+    def predict_dataset_sharded(self, dataset_path, processes, verbose=False,
+                                load_kwargs=None, per_class=None, seed=0,
+                                **kwargs):
+        """Predict a dataset split across worker processes, each loading
+        its own copy of the model with load_model
+
+        Parameters
+        ----------
+        dataset_path : str, path to folder containing images, see
+            predict_dataset
+        processes : int, number of worker processes
+        verbose : bool, print debug statements
+        load_kwargs : dict, keyword arguments passed to load_model
+        per_class : int, predict a stratified sample of this many images
+            per class, see list_dataset
+        seed : int, random seed of the sample
+        **kwargs : keyword arguments passed to predict_files in each worker
+
+        The attributes in SHARD_SETTINGS are copied to each worker, e.g.
+        weights, labels and the model cache.  Worker processes can't start
+        their own decode processes, so each worker prefetches with
+        threads, and the tensor cache is not shared with them.
+
+        Predictions and stage timings are merged back into self.d and
+        self.timings in dataset order.  Per worker results are stored in
+        self.shard_stats and aggregate results in self.pipeline_stats:
+        'images_per_s' is steady state throughput over the slowest
+        worker's predict time, 'wall_s' includes starting the pool and
+        'load_s' is the slowest worker's model load
+        """
+        import multiprocessing
+        import pandas as pd
+
+        if kwargs.get("output_file") is not None:
+            raise ValueError("output_file is not supported with shards")
+        if kwargs.get("pool", 'thread') != 'thread':
+            raise ValueError("Workers can only prefetch with pool='thread'")
+        files = self.list_dataset(dataset_path, verbose, per_class=per_class,
+                                  seed=seed)
+        shards = [files[n::processes] for n in range(processes)]
+        settings = {k: getattr(self, k) for k in SHARD_SETTINGS
+                    if hasattr(self, k)}
+        if load_kwargs is None:
+            load_kwargs = {}
+
+        # spawn, since a forked child would inherit the parent's TF session
+        ctx = multiprocessing.get_context('spawn')
+        t0 = time.perf_counter()
+        with ctx.Pool(processes) as mp_pool:
+            results = mp_pool.starmap(predict_shard,
+                                      [(type(self), settings, load_kwargs,
+                                        shard, kwargs) for shard in shards])
+        total_s = time.perf_counter() - t0
+
+        self.files = files
+        self.output_file = None
+        self.timings = StageTimer(len(files))
+        p_all = [None] * len(files)
+        stats = []
+        for n, (p_labels, timings, load_s, predict_s) in enumerate(results):
+            shard = shards[n]
+            self.timings.ns[n::processes] = timings.ns
+            self.timings.wall[n::processes] = timings.wall
+            p_all[n::processes] = p_labels
+            stats.append([n, len(shard), load_s, predict_s,
+                          len(shard) / predict_s if predict_s > 0 else 0.0])
+        self.d = {}
+        for (name, f_path), p_label in zip(files, p_all):
+            self.d.setdefault(name, []).append(p_label)
+        self.shard_stats = pd.DataFrame(stats, columns=["worker", "n_images",
+                                                        "load_s", "predict_s",
+                                                        "images_per_s"])
+        # workers predict concurrently, so steady state throughput is
+        # bounded by the slowest, without pool start and model loads
+        predict_s = self.shard_stats.predict_s.max()
+        self.pipeline_stats = {"n_images": len(files),
+                               "processes": processes,
+                               "wall_s": total_s,
+                               "load_s": self.shard_stats.load_s.max(),
+                               "predict_s": predict_s,
+                               "images_per_s": (len(files) / predict_s
+                                                if predict_s > 0 else 0.0)}
+
+    def benchmark(self, dataset_path, warmup=3, repeats=5, n_images=None,
+                  batch_size=None, confidence=0.95, verbose=False):
+        """Benchmark cold start separately from steady state throughput
+
+        Call directly after load_model so the first model call, which
+        includes graph construction, is measured as the cold start.
+
+        Parameters
+        ----------
+        dataset_path : str, path to folder containing images, see
+            predict_dataset
+        warmup : int, number of untimed model calls on one batch after
+            the cold start call
+        repeats : int, number of timed passes over the images
+        n_images : int, number of images evenly spaced through the
+            dataset to use.  Default None uses all images
+        batch_size : int, images per model call.  Default None uses
+            self.batch_size
+        confidence : float, confidence level of the throughput interval
+        verbose : bool, print debug statements
+
+        Returns
+        -------
+        dict, with keys:
+            load_s : float, seconds load_model took, see load_time_s
+            model_cache_hit : bool, whether load_model loaded a cached
+                model, None if the model cache is not enabled
+            cold_start_s : float, seconds for the first model call
+            images_per_s : float, mean steady state throughput
+            images_per_s_low, images_per_s_high : float, confidence
+                interval of images_per_s
+            repeat_s : list of float, seconds for each timed pass
+            n_images : int, images per timed pass
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        files = self.list_dataset(dataset_path, verbose)
+        if n_images is not None and n_images < len(files):
+            idx = np.linspace(0, len(files) - 1, n_images).astype(int)
+            files = [files[i] for i in idx]
+
+        inputs = [self.prepare(f_path)[0] for name, f_path
+                  in files[:batch_size]]
+        t0 = time.perf_counter()
+        self.run_model(inputs)
+        cold_start_s = time.perf_counter() - t0
+        for n in range(warmup):
+            self.run_model(inputs)
+
+        repeat_s = []
+        for n in range(repeats):
+            t0 = time.perf_counter()
+            self.predict_files(files, batch_size=batch_size)
+            repeat_s.append(time.perf_counter() - t0)
+            if verbose:
+                print('Repeat {}: {:.3f} s'.format(n, repeat_s[-1]))
+
+        mean, low, high = confidence_interval(len(files) / np.array(repeat_s),
+                                              confidence)
+        self.benchmark_stats = {"load_s": self.load_time_s,
+                                "model_cache_hit": (None if self.model_cache
+                                                    is None else
+                                                    self.model_cache.hit),
+                                "cold_start_s": cold_start_s,
+                                "images_per_s": mean,
+                                "images_per_s_low": low,
+                                "images_per_s_high": high,
+                                "confidence": confidence,
+                                "repeat_s": repeat_s,
+                                "n_images": len(files),
+                                "warmup": warmup,
+                                "batch_size": batch_size}
+        return self.benchmark_stats
+
+    def timing_report(self, q=(50, 90, 99)):
+        """Per-stage latency percentiles of the last predict_dataset run
+
+        Parameters
+        ----------
+        q : tuple of int, percentiles to report
+
+        Returns
+        -------
+        Pandas DataFrame, one row per stage with p<q> and max columns
+            in milliseconds.  Model and label stages are the batch time
+            divided evenly between the images in the batch.
+        """
+        return self.timings.percentiles(q)
+
+    def save_timings(self, profile_name):
+        """Save raw per-image stage timings in nanoseconds, next to the
+        predictions file, as <profile_name>_timings.csv
+
+        Parameters
+        ----------
+        profile_name : str, name of profile run
+        """
+        df = self.timings.to_frame()
+        df.insert(0, "file_path", [f_path for name, f_path in self.files])
+        df.to_csv(config.data_directory + os.path.sep +
+                  profile_name + '_timings.csv', sep=',', index=False)
+
+    def register_run(self, catalog, profile_name, **meta):
+        """Register this run and its saved files in a run catalog
+
+        Parameters
+        ----------
+        catalog : catalog.RunCatalog
+        profile_name : str, name of profile run, used as the run name
+        **meta : str, run metadata and artifact paths, see
+            catalog.RunCatalog.register.  Timings saved with save_timings
+            and a streamed output_file, as kind 'stream', are added when
+            they exist
+        """
+        timings_file = profile_name + '_timings.csv'
+        if ("timings" not in meta and os.path.exists(
+                os.path.join(catalog.data_directory, timings_file))):
+            meta["timings"] = timings_file
+        if "stream" not in meta and self.output_file is not None:
+            meta["stream"] = os.path.abspath(self.output_file)
+        catalog.register(profile_name, **meta)
 
     def collate_predictions(self):
         """Collate predictions into a Pandas DataFrame
@@ -123,40 +693,89 @@ class ImageClassifier:
         df : Pandas DataFrame, with one row per image and columns:
             y_true : true value of image being classified
             y_pred : predicted class of image
+            file_path : path to image file
         d_label_ax : list of str, labels for confusion matrix axes
+
+        If predict_dataset streamed to an output_file, it is read back
+        from disk instead of self.d
         """
+        import pandas as pd
+
+        if self.output_file is not None:
+            df = pd.read_csv(self.output_file,
+                             usecols=["file_path", "y_true", "y_pred"],
+                             dtype=str, keep_default_na=False)
+            df["y_true"] = [normalize_label(k) for k in df.y_true]
+            self.df = df[["y_true", "y_pred", "file_path"]]
+            return
         d_label = []
         d_pred = []
         for k, v in self.d.items():
-            k = k.strip().replace('_', ' ').lower()  # be consistent!
+            k = normalize_label(k)
             d_label += [k]*len(v)
             d_pred += v
         self.df = pd.DataFrame({"y_true":d_label, "y_pred":d_pred})
+        # each list in self.d is in the order of its files in self.files
+        if self.files is not None and len(self.files) == len(self.df):
+            d_path = {}
+            for name, f_path in self.files:
+                d_path.setdefault(name, []).append(f_path)
+            self.df["file_path"] = [f_path for k in self.d
+                                    for f_path in d_path.get(k, [])]
+
+    def setup_telemetry(self, server_ip, asynchronous=True):
+        """Connect to the event server
 
-    def setup_telemetry(self, server_ip):
-        self.telemetry = Telemetry(server_ip=server_ip)
+        Parameters
+        ----------
+        server_ip : str, IP address of event server
+        asynchronous : bool, queue timestamped events for a background
+            thread to send, see client.AsyncTelemetry.  False sends raw
+            strings with a blocking socket call
+
+        Set self.telemetry_sync_every to send a 'sync' event every N
+        batches, used as clock sync markers by energy.fit_clock
+        """
+        if asynchronous:
+            self.telemetry = AsyncTelemetry(server_ip=server_ip)
+        else:
+            self.telemetry = Telemetry(server_ip=server_ip)
         self.telemetry.connect()
         self.telemetry_enable = True
 
 class ClassifyRegular(ImageClassifier):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, batch_size=1):
+        super().__init__(batch_size=batch_size)
+        self.prepare_kwargs = {"to_array": True, "scale": True}
+        self.weights = 'imagenet'
 
     def load_model(self, model_instance=False):
-        """Load a pretrained model"""
+        """Load a pretrained model, or randomly initialized if
+        self.weights is None.  ImageNet labels are loaded unless
+        self.labels is already set.  Seconds taken are stored in
+        self.load_time_s"""
+        t0 = time.perf_counter()
+        if self.labels is None:
+            self.labels = LabelDecoder.from_imagenet()
         if not model_instance:
 
-            from keras.applications import mobilenet_v2
+            def build():
+                from keras.applications import mobilenet_v2
+
+                return mobilenet_v2.MobileNetV2(
+                           input_shape=(self.h, self.w, 3),
+                           weights=self.weights)
+                #, depth_multiplier=self.depth_multiplier)
 
-            self.model = mobilenet_v2.MobileNetV2(
-                             input_shape=(self.h, self.w, 3))
-            #, depth_multiplier=self.depth_multiplier)
+            self.model = self.build_model("mobilenet_v2", build,
+                                          weights=self.weights)
+        self.load_time_s = time.perf_counter() - t0
 
     def predict(self, image_a, top=1, score=False):
         p_n_label = self.model.predict(image_a)
-        pred = imagenet_utils.decode_predictions(p_n_label, top=top)
-        p_id, p_label, p_score = pred[0][0]
-        p_label = p_label.strip().replace('_', ' ').lower()  # be consistent!
+        ids, scores = self.labels.top_k(p_n_label, k=top)
+        p_label = str(self.labels[ids[0, 0]])
+        p_score = scores[0, 0]
         if score:
             return p_label, p_score
         else:
@@ -167,12 +786,27 @@ class ClassifyRegular(ImageClassifier):
         p_label = self.predict(image_a, top=top)
         return p_label
 
+    def run_model(self, inputs):
+        """Predict a batch of inputs with one model call"""
+        return self.model.predict(np.stack(inputs))
+
+    def decode_outputs(self, outputs):
+        return self.labels.decode(outputs)
+
 class ClassifyColabTPU(ImageClassifier):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, batch_size=1):
+        super().__init__(batch_size=batch_size)
+        self.prepare_kwargs = {"to_array": True, "scale": True}
 
     def load_model(self, model_instance=False):
-        """Load a pretrained model"""
+        """Load a pretrained model.  The tf.keras model is cached, if
+        enabled, before conversion to a TPU model, which is repeated on
+        every load.  Without a Colab TPU the tf.keras model is run as is.
+        Seconds taken are stored in self.load_time_s"""
+        import tensorflow as tf
+
+        t0 = time.perf_counter()
+        self.labels = LabelDecoder.from_imagenet()
         if not model_instance:
             try:
                 device_name = os.environ['COLAB_TPU_ADDR']
@@ -180,22 +814,31 @@ class ClassifyColabTPU(ImageClassifier):
                 print('Found TPU at: {}'.format(TPU_ADDRESS))
 
             except KeyError:
+                TPU_ADDRESS = None
                 print('TPU not found')
 
-            from keras.applications import mobilenet_v2
+            def build():
+                # keras_to_tpu_model only converts tf.keras models
+                return tf.keras.applications.MobileNetV2(
+                           input_shape=(self.h, self.w, 3))
+                #, depth_multiplier=self.depth_multiplier)
 
-            self.model = mobilenet_v2.MobileNetV2(
-                             input_shape=(self.h, self.w, 3))
-            #, depth_multiplier=self.depth_multiplier)
-            self.model = tf.tf.contrib.tpu.keras_to_tpu_model(self.model,
-                strategy=tf.contrib.tpu.TPUDistributionStrategy(
-                tf.contrib.cluster_resolver.TPUClusterResolver(TPU_ADDRESS)))
+            self.model = self.build_model(
+                "mobilenet_v2", build, weights="imagenet",
+                load_model=tf.keras.models.load_model, framework="tf.keras",
+                framework_version=tf.keras.__version__)
+            if TPU_ADDRESS is not None:
+                self.model = tf.contrib.tpu.keras_to_tpu_model(self.model,
+                    strategy=tf.contrib.tpu.TPUDistributionStrategy(
+                    tf.contrib.cluster_resolver.TPUClusterResolver(
+                        TPU_ADDRESS)))
+        self.load_time_s = time.perf_counter() - t0
 
     def predict(self, image_a, top=1, score=False):
         p_n_label = self.model.predict(image_a)
-        pred = imagenet_utils.decode_predictions(p_n_label, top=top)
-        p_id, p_label, p_score = pred[0][0]
-        p_label = p_label.strip().replace('_', ' ').lower()  # be consistent!
+        ids, scores = self.labels.top_k(p_n_label, k=top)
+        p_label = str(self.labels[ids[0, 0]])
+        p_score = scores[0, 0]
         if score:
             return p_label, p_score
         else:
@@ -206,6 +849,13 @@ class ClassifyColabTPU(ImageClassifier):
         p_label = self.predict(image_a, top=top)
         return p_label
 
+    def run_model(self, inputs):
+        """Predict a batch of inputs with one model call"""
+        return self.model.predict(np.stack(inputs))
+
+    def decode_outputs(self, outputs):
+        return self.labels.decode(outputs)
+
 class ClassifyEdgeTPU(ImageClassifier):
     def __init__(self):
         super().__init__()
@@ -215,7 +865,9 @@ class ClassifyEdgeTPU(ImageClassifier):
                            "mobilenet_v2_1.0_224_quant_edgetpu.tflite")
 
     def load_model(self, label_file=None, model_file=None):
-        """Load a pretrained model"""
+        """Load a pretrained model.  Seconds taken are stored in
+        self.load_time_s"""
+        t0 = time.perf_counter()
 
         # Prepared labels
         if label_file is not None:
@@ -229,17 +881,11 @@ class ClassifyEdgeTPU(ImageClassifier):
         from edgetpu.classification.engine import ClassificationEngine
 
         self.model = ClassificationEngine(self.model_file)
+        self.load_time_s = time.perf_counter() - t0
 
     def read_label_file(self, file_path):
         """Function to read labels from text files"""
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-        ret = {}
-        for line in lines:
-            num = line[:4].strip()
-            label = line[5:].strip().split(',')[0].lower()
-            ret[int(num)] = label
-        return ret
+        return LabelDecoder.from_label_file(file_path)
 
     def predict(self, image_a, top=5, score=False):
         pred = self.model.ClassifyWithImage(image_a)
@@ -248,13 +894,178 @@ class ClassifyEdgeTPU(ImageClassifier):
             p_score = 0.0
         else:
             p_n_label, p_score = pred[0]
-            p_label = self.labels[p_n_label]
+            p_label = str(self.labels[p_n_label])
         if score:
             return p_label, p_score
         else:
             return p_label
 
+    def run_model(self, inputs):
+        return [self.model.ClassifyWithImage(image_a) for image_a in inputs]
+
+    def decode_outputs(self, outputs):
+        ids = np.array([pred[0][0] if len(pred) > 0 else -1
+                        for pred in outputs], dtype=int)
+        p_labels = self.labels[ids].astype(object)
+        p_labels[ids < 0] = 'other'
+        return p_labels.tolist()
+
     def predict_file(self, file_path, top=5):
         image_a = self.preprocess(file_path)
         p_label = self.predict(image_a, top=top)
         return p_label
+
+
+def tflite_interpreter():
+    """TFLite Interpreter class, from the standalone tflite_runtime
+    package if installed, otherwise from Tensorflow"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    try:
+        return tf.lite.Interpreter
+    except AttributeError:
+        return tf.contrib.lite.Interpreter
+
+
+class ClassifyTFLite(ImageClassifier):
+    """Run a quantized or float .tflite model with the TFLite
+    interpreter on CPU
+
+    Parameters
+    ----------
+    batch_size : int, images per interpreter call
+    num_threads : int, interpreter threads, default None lets TFLite choose
+    """
+
+    def __init__(self, batch_size=1, num_threads=None):
+        super().__init__(batch_size=batch_size)
+        self.num_threads = num_threads
+        self.label_file = (config.download_directory + os.path.sep +
+                           "imagenet_labels.txt")
+        self.model_file = (config.download_directory + os.path.sep +
+                           "mobilenet_v2_1.0_224_quant.tflite")
+        self.prepare_kwargs = {"to_array": True}
+
+        self.input_index = None
+        self.output_index = None
+        self.input_shape = None
+        self.input_quantization = (0.0, 0)
+        self.output_quantization = (0.0, 0)
+
+    def load_model(self, label_file=None, model_file=None, num_threads=None):
+        """Load a .tflite model and allocate its tensors for
+        self.batch_size images.  uint8 models are fed raw 0 to 255 pixels,
+        float32 models pixels scaled to -1 to 1 and int8 models scaled
+        pixels quantized with the input scale and zero point.  Other
+        input dtypes raise ValueError.  Seconds taken are stored in
+        self.load_time_s"""
+        t0 = time.perf_counter()
+        if label_file is not None:
+            self.label_file = label_file
+        self.labels = LabelDecoder.from_label_file(self.label_file)
+        if model_file is not None:
+            self.model_file = model_file
+        if num_threads is not None:
+            self.num_threads = num_threads
+
+        Interpreter = tflite_interpreter()
+        try:
+            self.model = Interpreter(model_path=self.model_file,
+                                     num_threads=self.num_threads)
+        except TypeError:
+            # older interpreters have no num_threads argument
+            self.model = Interpreter(model_path=self.model_file)
+
+        input_details = self.model.get_input_details()[0]
+        self.input_index = input_details["index"]
+        shape = list(input_details["shape"])
+        self.h, self.w = int(shape[1]), int(shape[2])
+        if shape[0] != self.batch_size:
+            shape[0] = self.batch_size
+            self.model.resize_tensor_input(self.input_index, shape)
+        self.model.allocate_tensors()
+
+        self.input_shape = tuple(shape)
+        dtype = input_details["dtype"]
+        self.input_quantization = (0.0, 0)
+        if dtype == np.uint8:
+            # raw pixels, assumes the input scale and zero point map 0 to
+            # 255 to the range the model was trained on, as in the
+            # hosted quantized models
+            self.prepare_kwargs = {"to_array": True}
+        elif dtype == np.int8:
+            self.prepare_kwargs = {"to_array": True, "scale": True}
+            self.input_quantization = tuple(input_details["quantization"])
+            if self.input_quantization[0] == 0:
+                raise ValueError("int8 input of {} has no quantization "
+                                 "scale".format(self.model_file))
+        elif dtype == np.float32:
+            self.prepare_kwargs = {"to_array": True, "scale": True}
+        else:
+            raise ValueError("Unsupported input dtype {} of {}".format(
+                np.dtype(dtype).name, self.model_file))
+
+        output_details = self.model.get_output_details()[0]
+        self.output_index = output_details["index"]
+        self.output_quantization = output_details.get("quantization",
+                                                      (0.0, 0))
+        self.load_time_s = time.perf_counter() - t0
+
+    def run_model(self, inputs):
+        """Predict inputs in batches of self.batch_size, copying each
+        straight into the interpreter's input tensor.  The tensor view is
+        released before invoke, which fails while one is held.  Rows of
+        a partial batch left from the previous batch are ignored.
+
+        Returns
+        -------
+        Numpy Array, float scores of shape (len(inputs), n classes)
+        """
+        n_batch = self.input_shape[0]
+        outputs = []
+        for n in range(0, len(inputs), n_batch):
+            chunk = inputs[n:n + n_batch]
+            input_tensor = self.model.tensor(self.input_index)()
+            for i, image_a in enumerate(chunk):
+                input_tensor[i] = self.quantize(image_a)
+            del input_tensor
+            self.model.invoke()
+            outputs.append(self.model.get_tensor(self.output_index)
+                           [:len(chunk)].copy())
+        return self.dequantize(np.concatenate(outputs))
+
+    def quantize(self, image_a):
+        """Quantize scaled pixels for an int8 input, others unchanged"""
+        scale, zero_point = self.input_quantization
+        if scale == 0:
+            return image_a
+        return np.clip(np.round(image_a / scale + zero_point), -128, 127)
+
+    def dequantize(self, outputs):
+        """Convert quantized outputs to float scores"""
+        scale, zero_point = self.output_quantization
+        if scale == 0:
+            return outputs.astype(np.float32)
+        return (outputs.astype(np.float32) - zero_point) * scale
+
+    def decode_outputs(self, outputs):
+        return self.labels.decode(outputs)
+
+    def predict(self, image_a, top=1, score=False):
+        """Predict one prepared image, without the batch dimension"""
+        ids, scores = self.labels.top_k(self.run_model([image_a]), k=top)
+        p_label = str(self.labels[ids[0, 0]])
+        p_score = scores[0, 0]
+        if score:
+            return p_label, p_score
+        else:
+            return p_label
+
+    def predict_file(self, file_path, top=1):
+        image_a = self.prepare(file_path)[0]
+        p_label = self.predict(image_a, top=top)
+        return p_label
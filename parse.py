@@ -4,10 +4,8 @@ Colin Dietrich 2019
 """
 
 import os
-import io
 import json
 import pstats
-import pandas as pd
 
 import config
 
@@ -27,7 +25,7 @@ def collate(data_directory=config.data_directory):
     """
     
     files = []
-    for (dirpath, dirnames, filenames) in os.walk(config.data_directory):
+    for (dirpath, dirnames, filenames) in os.walk(data_directory):
         files.extend(filenames)
         break
     set_samples = set([x.split(" - ")[0] for x in files])
@@ -62,15 +60,107 @@ def csv_resource(fp):
     meta : dict, metadata describing data
     df : Pandas DataFrame, data recorded from device(s) described in meta
     """
+    return load_power(fp)
+
+def _cache_files(fp, cache_directory):
+    """Cache metadata file and frame file path without extension"""
+    if cache_directory is None:
+        cache_directory = os.path.join(os.path.dirname(os.path.abspath(fp)),
+                                       ".cache", "power")
+    base = os.path.join(cache_directory, os.path.basename(fp))
+    return base + ".json", base
+
+FRAME_EXTENSIONS = {"parquet": ".parquet", "pickle": ".pkl"}
+
+def write_frame(df, fp):
+    """Write a DataFrame as Parquet, or pickle if pyarrow is not installed
+
+    Parameters
+    ----------
+    df : Pandas DataFrame
+    fp : str, file path without extension, the extension of the format
+        written is added, see FRAME_EXTENSIONS
+
+    Returns
+    -------
+    str, format written, 'parquet' or 'pickle'
+    """
+    try:
+        df.to_parquet(fp + FRAME_EXTENSIONS["parquet"])
+        return "parquet"
+    except ImportError:
+        df.to_pickle(fp + FRAME_EXTENSIONS["pickle"])
+        return "pickle"
+
+def read_frame(fp, fmt):
+    """Read a DataFrame written by write_frame, fp without extension"""
+    import pandas as pd
+
+    if fmt == "parquet":
+        return pd.read_parquet(fp + FRAME_EXTENSIONS["parquet"])
+    return pd.read_pickle(fp + FRAME_EXTENSIONS["pickle"])
+
+def load_power(fp, time_format='%Y-%m-%d %H:%M:%S.%f', chunksize=2**20,
+               cache=True, cache_directory=None):
+    """Load a Meerkat power trace, cached as Parquet keyed by file mtime
+
+    The JSON header and data are read with one open and the data is read
+    in chunks.  Each chunk infers its own dtypes, which concat upcasts,
+    e.g. a column of integers in early rows and floats later is float64,
+    as when read whole.  Timestamps are parsed with an explicit format
+    into column 'datetime64_ns'.
+
+    Parameters
+    ----------
+    fp : str, filepath to saved data
+    time_format : str, strftime format of the time column, used if the
+        metadata has no 'strfmtime'
+    chunksize : int, number of rows read per chunk
+    cache : bool, read and write the columnar cache
+    cache_directory : str, path to cache folder, default None uses
+        '.cache/power' in the folder fp is in
+
+    Returns
+    -------
+    meta : dict, metadata describing data
+    df : Pandas DataFrame, data recorded from device(s) described in meta
+    """
+    import pandas as pd
+
+    stat = os.stat(fp)
+    meta_file, frame_file = _cache_files(fp, cache_directory)
+    if cache and os.path.exists(meta_file):
+        with open(meta_file, 'r') as f:
+            cached = json.load(f)
+        if (cached["mtime_ns"] == stat.st_mtime_ns and
+                cached["size"] == stat.st_size and
+                os.path.exists(frame_file +
+                               FRAME_EXTENSIONS[cached["format"]])):
+            return cached["meta"], read_frame(frame_file, cached["format"])
 
     with open(fp, 'r') as f:
         sbang = f.readline()
-    _meta = json.loads(sbang[2:])
-    _df = pd.read_csv(fp,
-                     delimiter=_meta['delimiter'],
-                     comment=_meta['comment'])
-    _df['datetime64_ns'] = pd.to_datetime(_df[_meta['time_format']])
+        _meta = json.loads(sbang[2:])
+        time_col = _meta['time_format']
+        chunks = pd.read_csv(f, delimiter=_meta['delimiter'],
+                             comment=_meta['comment'],
+                             dtype={time_col: str}, chunksize=chunksize)
+        _df = pd.concat(chunks, ignore_index=True)
+
+    fmt = _meta.get('strfmtime', time_format)
+    try:
+        t = pd.to_datetime(_df[time_col], format=fmt)
+    except ValueError:
+        t = pd.to_datetime(_df[time_col])
+    _df['datetime64_ns'] = t.astype('datetime64[ns]')
 
+    if cache:
+        if not os.path.exists(os.path.dirname(frame_file)):
+            os.makedirs(os.path.dirname(frame_file))
+        cached = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                  "meta": _meta, "format": write_frame(_df, frame_file)}
+        with open(meta_file, 'w') as f:
+            json.dump(cached, f)
     return _meta, _df
 
 def calc_W_h(_df, t0, t1):
@@ -78,7 +168,8 @@ def calc_W_h(_df, t0, t1):
 
     Parameters
     ----------
-    _df : Pandas DataFrame
+    _df : Pandas DataFrame, with columns 'datetime64_ns' and 'watts',
+        not modified
     t0 : datetime object, time of start of test
     t1 : datetime object, time of end of test
     
@@ -90,76 +181,250 @@ def calc_W_h(_df, t0, t1):
     W_max : float, max Watt use
     W_min : float, min Wat use
     W_mean_off : float, mean Wattage at idle
+
+    See energy.integrate_windows to integrate many windows at once
     """
-    
-    _df['dt'] = _df.datetime64_ns.diff()
-    _df['dts'] = _df.dt.dt.seconds + (_df.dt.dt.microseconds / 1000000)
-    _df['W_s'] = _df.watts * _df.dts
-    
-    _df_in = _df.loc[(_df.datetime64_ns > t0) & 
-                 (_df.datetime64_ns < t1)]
-    W_s = _df_in.W_s.sum()
-    dt = _df_in.datetime64_ns.max() - _df_in.datetime64_ns.min()
-    W_mean = _df_in.watts.mean()
-    W_max = _df_in.watts.max()
-    W_min = _df_in.watts.min()
-    W_h = W_s / (60 * 60)
-    
-    _df_out = _df[(_df.datetime64_ns < t0) | 
-                 (_df.datetime64_ns > t1)]
-    W_mean_off = _df_out.watts.mean()    
-    return W_h, dt, W_mean, W_max, W_min, W_mean_off
+    from energy import integrate_windows
+
+    _df = _df.sort_values('datetime64_ns')
+    r = integrate_windows(_df.datetime64_ns.values, _df.watts.values,
+                          t0, t1, rule='rectangle').iloc[0]
+    return r.W_h, r.duration, r.W_mean, r.W_max, r.W_min, r.W_mean_off
+
+def read_profile_window(fp):
+    """Start and end time of a profile run from its event log
+
+    Parameters
+    ----------
+    fp : str, path to either an EventServer CSV log, where the receive
+        times of the first 'profile_start' event and the following
+        'profile_end' event are used, or a legacy log with
+        '<time>,<message>' start and end lines
+
+    Returns
+    -------
+    start : Pandas Timestamp
+    end : Pandas Timestamp
+    """
+    import pandas as pd
+    from server import EVENT_COLUMNS, read_events
+
+    with open(fp, 'r') as f:
+        header = f.readline()
+        second = f.readline()
+    if header.strip().split(',') != EVENT_COLUMNS:
+        return (pd.to_datetime(header.split(',')[0]),
+                pd.to_datetime(second.split(',')[0]))
 
-def process(csv_file, timing_file):
-    _meta, _df = csv_resource(config.data_directory + csv_file)
+    df = read_events(fp)
+    m = df.m.str.strip()
+    starts = df.recv_datetime64_ns[m == "profile_start"]
+    if len(starts) == 0:
+        raise ValueError("No profile_start event in {}".format(fp))
+    start = starts.iloc[0]
+    ends = df.recv_datetime64_ns[(m == "profile_end") &
+                                 (df.recv_datetime64_ns >= start)]
+    if len(ends) == 0:
+        raise ValueError("No profile_end event in {}".format(fp))
+    return start, ends.iloc[0]
+
+def process(csv_file, timing_file, data_directory=config.data_directory):
+    _meta, _df = csv_resource(os.path.join(data_directory, csv_file))
     _df['watts'] = _df.voltage * _df.current
     
-    with open(config.data_directory + os.path.sep + timing_file, 'r') as f:
-        _start = f.readline().split(',')[0]
-        _end = f.readline().split(',')[0]
-        _start = pd.to_datetime(_start)
-        _end = pd.to_datetime(_end)
-        
+    _start, _end = read_profile_window(os.path.join(data_directory,
+                                                    timing_file))
+
     _W_h, dt, W_mean, W_max, W_min, W_mean_off = calc_W_h(_df, _start, _end)
     return _meta, _df, _start, _end, _W_h, dt, W_mean, W_max, W_min, W_mean_off
 
 def plot_profile(df, t0, t1):
+    import matplotlib.pyplot as plt
+
     df[['datetime64_ns', 'watts']].plot(x='datetime64_ns');
     plt.vlines(t0, 0, 5, colors='green')
     plt.vlines(t1, 0, 5, colors='red');
 
-def pstats_compile(profile_files):
-    data = []
-    for f in profile_files:
-        fp = os.path.normpath(config.data_directory) + os.path.sep + f
-        ps = Pstats(fp)
-        a = [ps.total_time_min, ps.platform, ps.pu, ps.pu_type, ps.tf_version, ps.run_id,
-             ps.acc, ps.acc_dog, ps.filepath]
-        data.append(a)
-    cols = ["time_min", "platform", "PU", "PU_type", "TF_version", "run_id", 
-            "acc", "acc_dog", "filepath"]
-    return pd.DataFrame(data, columns=cols)
-
-def power_compile(power_files):
+PSTATS_COLUMNS = ["time_min", "platform", "PU", "PU_type", "TF_version",
+                  "run_id", "acc", "acc_dog", "filepath"]
+
+POWER_COLUMNS = ["platform", "PU", "PU_type", "TF_version", "run_id",
+                 "power_time", "Watt_hours", "Watts_mean", "Watts_max",
+                 "Watts_min", "Watts_mean_off"]
+
+def pstats_summary(profile_file, data_directory=config.data_directory,
+                   predictions_file=None, meta=None):
+    """Summary row of one profile, see PSTATS_COLUMNS and Pstats"""
+    fp = os.path.join(data_directory, profile_file)
+    if predictions_file is not None:
+        predictions_file = os.path.join(data_directory, predictions_file)
+    ps = Pstats(fp, predictions_file=predictions_file, meta=meta)
+    return [ps.total_time_min, ps.platform, ps.pu, ps.pu_type, ps.tf_version,
+            ps.run_id, ps.acc, ps.acc_dog, ps.filepath]
+
+def power_summary(power_csv, profile_txt, data_directory=config.data_directory,
+                  meta=None):
+    """Summary row of one power trace, see POWER_COLUMNS
+
+    meta : dict, run metadata, see Pstats.  Default None parses it
+        from the filename
+    """
+    if meta is None:
+        fid = power_csv.split(" - ")
+        fid = fid[0].split("_")
+    else:
+        fid = [meta[k] for k in ("platform", "pu", "pu_type",
+                                 "tf_version", "run_id")]
+    (meta, df, t0, t1, w_h, dt, 
+     W_mean, W_max, W_min, W_mean_off) = process(power_csv, profile_txt,
+                                                 data_directory)
+    return fid + [dt, w_h, W_mean, W_max, W_min, W_mean_off]
+
+def pstats_compile(profile_files, data_directory=config.data_directory):
+    import pandas as pd
+
+    data = [pstats_summary(f, data_directory) for f in profile_files]
+    return pd.DataFrame(data, columns=PSTATS_COLUMNS)
+
+def power_compile(power_files, data_directory=config.data_directory):
     """Compile power profile data"""
+    import pandas as pd
+
     power_data = []
     for power_csv, profile_txt in power_files:
         if power_csv is not None:
-            fid = power_csv.split(" - ")
-            fid = fid[0].split("_")
-            (meta, df, t0, t1, w_h, dt, 
-             W_mean, W_max, W_min, W_mean_off) = process(power_csv, 
-                                                         profile_txt)
-            power_data.append(fid + [dt, w_h, W_mean, W_max, W_min, W_mean_off])
-
-    columns = ["platform", "PU", "PU_type", "TF_version", "run_id", "power_time", 
-               "Watt_hours", "Watts_mean", "Watts_max", "Watts_min", "Watts_mean_off"]
-    _df = pd.DataFrame(power_data, columns=columns)
+            power_data.append(power_summary(power_csv, profile_txt,
+                                            data_directory))
+    _df = pd.DataFrame(power_data, columns=POWER_COLUMNS)
     return _df
 
+def _signature(data_directory, file_names):
+    """(name, size, mtime) of each file, changes when any file does"""
+    sig = []
+    for f in file_names:
+        st = os.stat(os.path.join(data_directory, f))
+        sig.append((f, st.st_size, st.st_mtime_ns))
+    return tuple(sig)
+
+def _run_task(task):
+    kind, args, kwargs = task
+    if kind == "pstats":
+        return pstats_summary(*args, **kwargs)
+    return power_summary(*args, **kwargs)
+
+def _catalog_tasks(catalog):
+    """Compile tasks for every run registered in a catalog"""
+    tasks = []
+    for run in catalog.runs():
+        meta = {k: run[k] for k in ("platform", "pu", "pu_type",
+                                    "tf_version", "run_id")}
+        a = run["artifacts"]
+        if "pstats" in a and "predictions" in a:
+            tasks.append(("pstats", (a["pstats"],),
+                          {"predictions_file": a["predictions"],
+                           "meta": meta},
+                          [a["pstats"], a["predictions"]]))
+        if "power" in a and "events" in a:
+            tasks.append(("power", (a["power"], a["events"]), {"meta": meta},
+                          [a["power"], a["events"]]))
+    return tasks
+
+def compile_results(data_directory=config.data_directory, processes=None,
+                    cache=True, catalog=None):
+    """Compile profile and power statistics in parallel, reparsing only
+    new or changed files
+
+    Parameters
+    ----------
+    data_directory : str, path to directory with power and profile data files
+    processes : int, number of worker processes, default None uses the
+        number of CPUs
+    cache : bool, reuse results cached in '.cache/compile.pkl' in
+        data_directory, keyed by each file's path, size and mtime
+    catalog : catalog.RunCatalog, compile the runs registered in it
+        instead of scanning data_directory for filename conventions
+
+    Returns
+    -------
+    df_stats : Pandas DataFrame, see pstats_compile
+    df_power : Pandas DataFrame, see power_compile
+    """
+    import pickle
+    import pandas as pd
+    from concurrent import futures
+
+    if catalog is not None:
+        data_directory = catalog.data_directory
+        tasks = _catalog_tasks(catalog)
+    else:
+        power_files, profile_files = collate(data_directory)
+        tasks = []
+        for f in profile_files:
+            tasks.append(("pstats", (f,), {},
+                          [f, f.split(' - pstats.txt')[0] +
+                           ' - predictions.csv']))
+        for power_csv, profile_txt in power_files:
+            if power_csv is not None:
+                tasks.append(("power", (power_csv, profile_txt), {},
+                              [power_csv, profile_txt]))
+
+    cache_file = os.path.join(data_directory, ".cache", "compile.pkl")
+    cached = {}
+    if cache and os.path.exists(cache_file):
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+
+    rows = [None] * len(tasks)
+    todo = []
+    new_cache = {}
+    for n, (kind, args, kwargs, deps) in enumerate(tasks):
+        key = (kind, args, repr(sorted(kwargs.items())))
+        sig = _signature(data_directory, deps)
+        hit = cached.get(key)
+        if hit is not None and hit[0] == sig:
+            rows[n] = hit[1]
+            new_cache[key] = hit
+        else:
+            todo.append((n, key, sig))
+
+    if len(todo) > 0:
+        with futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            results = executor.map(_run_task,
+                                   [(tasks[n][0], tasks[n][1],
+                                     dict(tasks[n][2],
+                                          data_directory=data_directory))
+                                    for n, key, sig in todo])
+            for (n, key, sig), row in zip(todo, results):
+                rows[n] = row
+                new_cache[key] = (sig, row)
+
+    if cache:
+        if not os.path.exists(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        with open(cache_file + '.tmp', 'wb') as f:
+            pickle.dump(new_cache, f)
+        os.replace(cache_file + '.tmp', cache_file)
+
+    stats_rows = [r for task, r in zip(tasks, rows) if task[0] == "pstats"]
+    power_rows = [r for task, r in zip(tasks, rows) if task[0] == "power"]
+    return (pd.DataFrame(stats_rows, columns=PSTATS_COLUMNS),
+            pd.DataFrame(power_rows, columns=POWER_COLUMNS))
+
 class Pstats(object):
-    def __init__(self, filepath):
-        
+    """Function table and accuracy of one profiled run
+
+    Parameters
+    ----------
+    filepath : str, path to pstats file
+    predictions_file : str, path to predictions CSV, default None uses
+        filepath with ' - pstats.txt' replaced by ' - predictions.csv'
+    meta : dict, run metadata with keys 'platform', 'pu', 'pu_type',
+        'tf_version' and 'run_id', e.g. from catalog.RunCatalog.  Default
+        None parses them from the filename
+    """
+    def __init__(self, filepath, predictions_file=None, meta=None):
+        import pandas as pd
+
         # basic pstats info
         self.filepath = filepath
         self.p = pstats.Stats(self.filepath)
@@ -167,15 +432,20 @@ class Pstats(object):
         self.total_time_min = self.total_time_s / 60.0
         
         fspred = self.filepath.split(' - pstats.txt')
-        self.df_pred = pd.read_csv(fspred[0] + ' - predictions.csv')
+        if predictions_file is None:
+            predictions_file = fspred[0] + ' - predictions.csv'
+        self.df_pred = pd.read_csv(predictions_file)
         
-        fp = fspred[0].split(os.path.sep)
-        fs = fp[-1].split('_')
-        self.platform = fs[0]
-        self.pu = fs[1]
-        self.pu_type = fs[2]
-        self.tf_version = fs[3]
-        self.run_id = fs[4]
+        if meta is None:
+            fp = fspred[0].split(os.path.sep)
+            fs = fp[-1].split('_')
+            meta = {"platform": fs[0], "pu": fs[1], "pu_type": fs[2],
+                    "tf_version": fs[3], "run_id": fs[4]}
+        self.platform = meta["platform"]
+        self.pu = meta["pu"]
+        self.pu_type = meta["pu_type"]
+        self.tf_version = meta["tf_version"]
+        self.run_id = meta["run_id"]
         
         # accuracy
         n = len(self.df_pred)
@@ -185,53 +455,127 @@ class Pstats(object):
         
         # precision
         
-        # capture print output
-        self.sio = io.StringIO()
-        self.stats = pstats.Stats(self.filepath, stream=self.sio)
-        self.stats.print_stats();
-        self.data = self.sio.getvalue().split("\n")
-        
-        # store parsed data in list and dataframe
-        self.column_names = ['ncalls',
+        # function table built directly from the loaded stats
+        self.stats = self.p
+        self.column_names = ['filename',
+                             'lineno',
+                             'function',
+                             'filename:lineno(function)',
+                             'short_name',
+                             'ncalls',
+                             'pcalls',
                              'tottime',
-                             'percall',
+                             'tottime_percall',
                              'cumtime',
-                             'percall',
-                             'filename:lineno(function)']
+                             'cumtime_percall',
+                             'n_callers']
+        self.df = self.stats_frame(self.p.stats)
+        self.short_index = {}
+        for key, short in zip(self.df.index, self.df.short_name):
+            # None marks a short name shared by functions in two files
+            self.short_index[short] = (None if short in self.short_index
+                                       else key)
+        self._callees = None
+
+    @staticmethod
+    def func_key(func):
+        """'filename:lineno(function)' key of a pstats function tuple,
+        formatted as print_stats does"""
+        return pstats.func_std_string(func)
+
+    def stats_frame(self, stats):
+        """Build the function table from a pstats.Stats.stats dict
+
+        Parameters
+        ----------
+        stats : dict, (filename, lineno, function) to
+            (primitive calls, total calls, tottime, cumtime, callers)
+
+        Returns
+        -------
+        Pandas DataFrame, one row per function indexed by
+            'filename:lineno(function)', sorted by cumtime
+        """
+        import pandas as pd
+
+        rows = []
+        for func, (cc, nc, tt, ct, callers) in stats.items():
+            filename, lineno, function = func
+            rows.append([filename, lineno, function, self.func_key(func),
+                         self.func_key((os.path.basename(filename),
+                                        lineno, function)),
+                         nc, cc, tt, tt / nc if nc else 0.0,
+                         ct, ct / cc if cc else 0.0, len(callers)])
+        df = pd.DataFrame(rows, columns=self.column_names)
+        df = df.astype({'lineno': 'int64', 'ncalls': 'int64',
+                        'pcalls': 'int64', 'n_callers': 'int64'})
+        df.sort_values('cumtime', ascending=False, inplace=True)
+        df.index = df['filename:lineno(function)'].values
+        return df
+
+    def _key(self, filename_lineno):
+        if filename_lineno in self.df.index:
+            return filename_lineno
+        key = self.short_index[filename_lineno]
+        if key is None:
+            raise KeyError("{} is in more than one file, use the full "
+                           "path".format(filename_lineno))
+        return key
+
+    def _func(self, filename_lineno):
+        row = self.df.loc[self._key(filename_lineno)]
+        return (row.filename, row.lineno, row.function)
 
-        self.a = []
-        self.df = pd.DataFrame()
-        self.parse_list(self.data)
-        
-    def parse_list(self, data_list):
-        """Parse the list of data from pstats print method"""
-        r = False
-        for line in data_list:
-            if len(line) == 0:
-                continue
-            if 'ncalls' in line:
-                r = True
-            if not r:
-                continue
-            line_list = line.split()
-            if "/" in line_list[0]:
-                x0 = line_list[0].split("/")
-                line_list = [x0[0]] + line_list[1:]
-            self.a.append(line_list[0:6])
-        self.df = pd.DataFrame(self.a[1:], 
-                               columns=self.column_names,
-                               dtype=float)
-        self.df.sort_values('cumtime', ascending=False, inplace=True)
-        
     def calc_time(self, filename_lineno):
         """Find the time spent on a specific filename and
         line number
         
         Example filename_lineno might be:
         "tensorflow_backend.py:2696(__call__)"
-        
+
+        Either the full path or only the file name can be used.  A file
+        name shared by two profiled files raises KeyError.
+        """
+        return self.df.at[self._key(filename_lineno), 'cumtime']
+
+    def _edges(self, edges):
+        import pandas as pd
+
+        rows = []
+        for func, v in edges.items():
+            # callers values are (cc, nc, tt, ct), or a call count for
+            # stats from older profilers
+            if not isinstance(v, tuple):
+                v = (v, v, 0.0, 0.0)
+            cc, nc, tt, ct = v
+            rows.append([self.func_key(func), nc, cc, tt, ct])
+        df = pd.DataFrame(rows, columns=['filename:lineno(function)',
+                                         'ncalls', 'pcalls', 'tottime',
+                                         'cumtime'])
+        return df.sort_values('cumtime', ascending=False
+                              ).reset_index(drop=True)
+
+    def callers(self, filename_lineno):
+        """Functions that called filename_lineno, with the calls and
+        time attributed to each caller
+
+        Returns
+        -------
+        Pandas DataFrame, one row per caller sorted by cumtime
+        """
+        return self._edges(self.p.stats[self._func(filename_lineno)][4])
+
+    def callees(self, filename_lineno):
+        """Functions called by filename_lineno, with the calls and
+        time attributed to this caller
+
+        Returns
+        -------
+        Pandas DataFrame, one row per callee sorted by cumtime
         """
-        cn = "filename:lineno(function)"
-        return self.df[self.df[cn] == filename_lineno].cumtime.values[0]
+        if self._callees is None:
+            self.p.calc_callees()
+            self._callees = self.p.all_callees
+        return self._edges(self._callees.get(self._func(filename_lineno), {}))
 
 
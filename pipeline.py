@@ -0,0 +1,81 @@
+"""Prefetching pipeline stage to overlap image decode with inference"""
+
+import time
+import collections
+from concurrent import futures
+
+
+class Prefetcher:
+    """Apply a function to items in a worker pool ahead of the consumer
+
+    At most `depth` items are in flight at once, so memory stays bounded
+    no matter how large the dataset is.  Results are yielded in the same
+    order as items.
+
+    Parameters
+    ----------
+    fn : callable, applied to each item, must be picklable when
+        pool='process' (i.e. a module level function or partial)
+    items : iterable, inputs to fn
+    depth : int, number of items decoded ahead of the consumer,
+        0 runs fn inline on the consumer thread
+    workers : int, number of pool workers
+    pool : str, 'thread' or 'process'
+
+    Attributes
+    ----------
+    stall_s : float, seconds the consumer spent waiting on fn results
+    n : int, number of results yielded
+    """
+
+    def __init__(self, fn, items, depth=8, workers=2, pool='thread'):
+        if pool not in ('thread', 'process'):
+            raise ValueError("pool must be 'thread' or 'process', not {}"
+                             .format(pool))
+        self.fn = fn
+        self.items = items
+        self.depth = depth
+        self.workers = workers
+        self.pool = pool
+
+        self.stall_s = 0.0
+        self.n = 0
+
+    def __iter__(self):
+        if self.depth < 1:
+            return self._serial()
+        return self._pooled()
+
+    def _serial(self):
+        for item in self.items:
+            t0 = time.perf_counter()
+            result = self.fn(item)
+            self.stall_s += time.perf_counter() - t0
+            self.n += 1
+            yield result
+
+    def _pooled(self):
+        if self.pool == 'process':
+            executor = futures.ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            executor = futures.ThreadPoolExecutor(max_workers=self.workers)
+        in_flight = collections.deque()
+        items = iter(self.items)
+        try:
+            for item in items:
+                in_flight.append(executor.submit(self.fn, item))
+                if len(in_flight) >= self.depth:
+                    break
+            while in_flight:
+                t0 = time.perf_counter()
+                result = in_flight.popleft().result()
+                self.stall_s += time.perf_counter() - t0
+                for item in items:
+                    in_flight.append(executor.submit(self.fn, item))
+                    break
+                self.n += 1
+                yield result
+        finally:
+            for f in in_flight:
+                f.cancel()
+            executor.shutdown(wait=True)
@@ -2,11 +2,16 @@
 
 2019 Colin Dietrich"""
 
+import io
+import os
+import csv
 import time
 import socket
 import atexit
+import asyncio
 
 import config
+from client import decode_event
 
 
 class PowerProfiler:
@@ -30,19 +35,176 @@ class PowerProfiler:
         return data
 
 
-if __name__ == "__main__":
-    pp = PowerProfiler()
-    pp.serve()
-    while True:
-        with open('profile_output.txt', 'w') as f:
-            x = pp.recv()
-            x = x.decode('utf-8')
-            if 'profile' in x:
-                d = "{},{}".format(time.ctime(), x)
-                print(d)            
-            if 'profile_end' in x:
-                pp.s.close()                
-                break
-            
-    pp.s.close()
+EVENT_COLUMNS = ["recv_wall", "peer", "mono", "wall", "m"]
+
+
+class EventServer:
+    """Collect framed events from many devices at once with asyncio
+
+    Each connection is read one newline framed event at a time, see
+    client.encode_event, and appended to a CSV log with the receive
+    time and peer address.  The log is written through a large buffer
+    and flushed every flush_interval seconds.
+
+    Parameters
+    ----------
+    host : str, IP address to listen on, default config.server_ip
+    port : int, port to listen on, default config.server_port
+    log_file : str, path to CSV event log, appended to if it exists
+    flush_interval : float, seconds between log flushes
+    verbose : bool, print each event
+
+    Attributes
+    ----------
+    n_events : int, number of events logged
+    peers : set of str, addresses of connected devices
+    """
+
+    def __init__(self, host=None, port=None, log_file='profile_events.csv',
+                 flush_interval=1.0, verbose=False):
+        self.host = config.server_ip if host is None else host
+        self.port = config.server_port if port is None else port
+        self.log_file = log_file
+        self.flush_interval = flush_interval
+        self.verbose = verbose
+
+        self.n_events = 0
+        self.peers = set()
+
+        self.server = None
+        self.flush_task = None
+        self.f = None
+        self.writer = None
+
+    async def start(self):
+        """Open the log and start accepting connections"""
+        new = (not os.path.exists(self.log_file) or
+               os.path.getsize(self.log_file) == 0)
+        self.f = io.open(self.log_file, 'a', newline='', buffering=2**20)
+        self.writer = csv.writer(self.f)
+        if new:
+            self.writer.writerow(EVENT_COLUMNS)
+        self.server = await asyncio.start_server(self.handle, self.host,
+                                                 self.port)
+        self.flush_task = asyncio.ensure_future(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while self.f is not None:
+            await asyncio.sleep(self.flush_interval)
+            if self.f is not None:
+                self.f.flush()
+
+    async def handle(self, reader, writer):
+        """Read framed events from one device until it disconnects"""
+        peer = "{}:{}".format(*writer.get_extra_info('peername')[:2])
+        self.peers.add(peer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                self.log(peer, decode_event(line))
+        except ConnectionError:
+            pass
+        finally:
+            self.peers.discard(peer)
+            writer.close()
+
+    def log(self, peer, event):
+        """Append one event to the log
 
+        Parameters
+        ----------
+        peer : str, address of device
+        event : dict, see client.decode_event
+        """
+        row = [time.time(), peer, event.get("mono"), event.get("wall"),
+               event.get("m")]
+        self.writer.writerow(row)
+        self.n_events += 1
+        if self.verbose:
+            print(",".join(str(x) for x in row))
+
+    async def stop(self):
+        """Stop accepting connections and flush the log"""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        if self.f is not None:
+            f = self.f
+            self.f = None
+            f.close()
+
+    def run(self):
+        """Serve until interrupted with Ctrl-C"""
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.start())
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(self.stop())
+
+
+def read_events(log_file, peer=None, message=None, t0=None, t1=None):
+    """Query an EventServer log
+
+    Parameters
+    ----------
+    log_file : str, path to CSV event log
+    peer : str, only events from this device address
+    message : str, only events whose message contains this text
+    t0 : datetime-like, only events received at or after this time
+    t1 : datetime-like, only events received before this time
+
+    Returns
+    -------
+    Pandas DataFrame, one row per event in receive order, with
+        datetime64_ns columns for the receive and source wall times
+    """
+    import pandas as pd
+
+    df = pd.read_csv(log_file, dtype={"peer": str, "m": str})
+    df["recv_datetime64_ns"] = pd.to_datetime(df.recv_wall, unit='s')
+    df["datetime64_ns"] = pd.to_datetime(df.wall, unit='s')
+    mask = pd.Series(True, index=df.index)
+    if peer is not None:
+        mask &= df.peer == peer
+    if message is not None:
+        mask &= df.m.str.contains(message, regex=False, na=False)
+    if t0 is not None:
+        mask &= df.recv_datetime64_ns >= pd.Timestamp(t0)
+    if t1 is not None:
+        mask &= df.recv_datetime64_ns < pd.Timestamp(t1)
+    return df[mask].reset_index(drop=True)
+
+
+def replay(log_file, fn, speed=None, **kwargs):
+    """Call fn with each logged event in receive order
+
+    Parameters
+    ----------
+    log_file : str, path to CSV event log
+    fn : callable, called with each event row as a Pandas namedtuple
+    speed : float, replay in real time scaled by speed (2.0 is twice as
+        fast), default None replays as fast as possible
+    **kwargs : keyword arguments passed to read_events
+    """
+    df = read_events(log_file, **kwargs)
+    t_last = None
+    for row in df.itertuples(index=False):
+        if speed is not None and t_last is not None:
+            time.sleep(max(row.recv_wall - t_last, 0) / speed)
+        t_last = row.recv_wall
+        fn(row)
+
+
+if __name__ == "__main__":
+    EventServer(verbose=True).run()
@@ -0,0 +1,6 @@
+"""The package is a flat folder of modules, import them from the root"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,57 @@
+"""Fake model for testing the classifier pipeline without Keras"""
+
+import io
+import os
+import numpy as np
+
+from archive import read_bytes
+from models import ImageClassifier
+from labels import LabelDecoder
+
+N_LABELS = 7
+
+
+def make_dataset(directory, n_classes=3, per_class=4, seed=0):
+    """Write small random 'images' in class folders named like the
+    Stanford Dogs layout, '<wordnet id>-<class name>'.  They are .npy
+    arrays named .jpg, so archive.TarImageSource indexes them"""
+    rs = np.random.RandomState(seed)
+    for c in range(n_classes):
+        class_dir = os.path.join(str(directory), "n{:08d}-class_{}".format(c, c))
+        os.makedirs(class_dir)
+        for n in range(per_class):
+            with open(os.path.join(class_dir, "img_{}.jpg".format(n)),
+                      'wb') as f:
+                np.save(f, rs.rand(4, 4, 3).astype(np.float32))
+    return str(directory)
+
+
+class FakeClassifier(ImageClassifier):
+    """Linear model over flattened pixels, with a per-image path that
+    runs each image through the model on its own"""
+
+    def __init__(self, batch_size=1):
+        super().__init__(batch_size=batch_size)
+        self.labels = LabelDecoder(["label_{}".format(n)
+                                    for n in range(N_LABELS)])
+        self.W = np.random.RandomState(1).randn(4 * 4 * 3, N_LABELS)
+        self.n_calls = 0
+
+    def load_model(self):
+        pass
+
+    def prepare(self, file_path):
+        return np.load(io.BytesIO(read_bytes(file_path))), (0, 0, 0)
+
+    def run_model(self, inputs):
+        self.n_calls += 1
+        a = np.stack(inputs)
+        return a.reshape(len(a), -1).dot(self.W)
+
+    def decode_outputs(self, outputs):
+        return self.labels.decode(outputs)
+
+    def predict_file(self, file_path):
+        image_a = self.prepare(file_path)[0]
+        ids, scores = self.labels.top_k(self.run_model([image_a]), k=1)
+        return str(self.labels[ids[0, 0]])
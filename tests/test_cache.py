@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+
+from cache import ModelCache, TensorCache
+
+
+class StubModel:
+    """Saves its weights like a Keras model saves to .h5"""
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    def save(self, fp):
+        with open(fp, 'wb') as f:
+            np.save(f, self.weights)
+
+
+def load_stub(fp, custom_objects=None, compile=True):
+    with open(fp, 'rb') as f:
+        return StubModel(np.load(f))
+
+
+def test_model_cache_round_trip(tmp_path):
+    mc = ModelCache(str(tmp_path / "model_cache"))
+    key = mc.key("mobilenet_v2", (224, 224, 3), "imagenet",
+                 framework="tf.keras", framework_version="2.1.6-tf")
+    assert "tf.keras2.1.6-tf" in key
+    assert key != mc.key("mobilenet_v2", (224, 224, 3), "imagenet",
+                         framework="keras", framework_version="2.1.6-tf")
+
+    built = []
+
+    def build():
+        built.append(1)
+        return StubModel(np.arange(4.0))
+
+    m = mc.get_or_build(key, build, load_model=load_stub)
+    assert not mc.hit and len(built) == 1
+    m = mc.get_or_build(key, build, load_model=load_stub)
+    assert mc.hit and len(built) == 1
+    assert m.weights.tolist() == [0.0, 1.0, 2.0, 3.0]
+
+    mc.clear()
+    mc.get_or_build(key, build, load_model=load_stub)
+    assert not mc.hit and len(built) == 2
+
+
+def test_tensor_cache_round_trip(tmp_path):
+    image = tmp_path / "img_0.jpg"
+    image.write_bytes(b"jpeg")
+    directory = str(tmp_path / "tensor_cache")
+    tc = TensorCache(directory, shard_size=2)
+    keys = [tc.key(str(image), 2, 2, mode) for mode in ["tf", "none", "raw"]]
+    arrays = [np.full((2, 2, 3), n, dtype=np.float32) for n in range(3)]
+    assert tc.get(keys[0]) is None
+    for key, a in zip(keys, arrays):
+        tc.put(key, a)
+    assert np.array_equal(tc.get(keys[2]), arrays[2])
+    tc.flush()
+
+    tc = TensorCache(directory, shard_size=2)
+    for key, a in zip(keys, arrays):
+        cached = tc.get(key)
+        assert np.array_equal(cached, a)
+        assert not cached.flags.writeable
+    assert (tc.hits, tc.misses) == (3, 0)
+
+    st = os.stat(str(image))
+    os.utime(str(image), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert tc.key(str(image), 2, 2, "tf") != keys[0]
+
+    tc.max_bytes = tc.index["shards"]["shard_000001.npy"]["bytes"]
+    tc.index["shards"]["shard_000000.npy"]["last_used"] = 0
+    tc.evict()
+    assert tc.get(keys[0]) is None
+    assert np.array_equal(tc.get(keys[2]), arrays[2])
@@ -0,0 +1,40 @@
+import os
+
+from catalog import RunCatalog
+from fakes import FakeClassifier, make_dataset
+
+
+def test_register_run_keeps_stream_apart_from_predictions(tmp_path):
+    dataset = make_dataset(tmp_path / "images", n_classes=2, per_class=3)
+    data_directory = str(tmp_path / "data")
+    os.makedirs(data_directory)
+    catalog = RunCatalog(data_directory=data_directory)
+
+    m = FakeClassifier(batch_size=2)
+    m.predict_files(m.list_dataset(dataset),
+                    output_file=os.path.join(data_directory, "stream.csv"))
+    m.register_run(catalog, "linux_i7_CPU_1.10_001", platform="linux")
+
+    run = catalog.runs(platform="linux")[0]
+    assert "predictions" not in run["artifacts"]
+    assert os.path.isabs(run["artifacts"]["stream"])
+    assert catalog.resolve(run["artifacts"]["stream"]) == \
+        run["artifacts"]["stream"]
+    catalog.close()
+
+
+def test_register_again_keeps_metadata(tmp_path):
+    catalog = RunCatalog(data_directory=str(tmp_path))
+    catalog.register("win10_i7_CPU_1.10_001", platform="win10", pu="i7",
+                     pu_type="CPU", tf_version="1.10", run_id="001",
+                     pstats="a.pstats")
+    catalog.register("win10_i7_CPU_1.10_001", power="b - power.csv")
+    catalog.register("win10_i7_CPU_1.10_001", run_id="002")
+
+    run = catalog.runs(pu="i7")[0]
+    assert [run[k] for k in ["platform", "pu", "pu_type", "tf_version",
+                             "run_id"]] == ["win10", "i7", "CPU", "1.10",
+                                            "002"]
+    assert run["artifacts"] == {"pstats": "a.pstats",
+                                "power": "b - power.csv"}
+    catalog.close()
@@ -0,0 +1,54 @@
+import csv
+
+import pytest
+
+from checkpoint import PredictionWriter
+from fakes import FakeClassifier, make_dataset
+
+COLUMNS = ["file_path", "y_true", "y_pred"]
+
+
+def read_rows(file_path):
+    with open(file_path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_resume_truncates_after_last_checkpoint(tmp_path):
+    fp = str(tmp_path / "pred.csv")
+    w = PredictionWriter(fp, COLUMNS, chunk_size=2)
+    w.write([["a", "x", "x"], ["b", "y", "y"]])  # flushed and checkpointed
+    w.write([["c", "z", "z"]])  # buffered only
+    with open(fp, 'a') as f:
+        f.write("d,partial")  # crash in the middle of a write
+
+    w = PredictionWriter(fp, COLUMNS, chunk_size=2, resume=True)
+    assert w.done == {"a", "b"}
+    w.write([["c", "z", "z"]])
+    w.close()
+    assert read_rows(fp) == [COLUMNS, ["a", "x", "x"], ["b", "y", "y"],
+                             ["c", "z", "z"]]
+
+
+def test_resume_rejects_other_columns(tmp_path):
+    fp = str(tmp_path / "pred.csv")
+    PredictionWriter(fp, COLUMNS).close()
+    with pytest.raises(ValueError):
+        PredictionWriter(fp, COLUMNS + ["extra"], resume=True)
+
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path):
+    dataset = make_dataset(tmp_path / "images", n_classes=3, per_class=4)
+    m = FakeClassifier(batch_size=5)
+    files = m.list_dataset(dataset)
+
+    full = str(tmp_path / "full.csv")
+    m.predict_files(files, output_file=full, chunk_size=3)
+
+    part = str(tmp_path / "part.csv")
+    m.predict_files(files[:7], output_file=part, chunk_size=3)
+    m.predict_files(files, output_file=part, resume=True, chunk_size=3)
+    assert len(m.files) == 5
+
+    def predictions(fp):
+        return sorted(tuple(r[:3]) for r in read_rows(fp)[1:])
+    assert predictions(part) == predictions(full)
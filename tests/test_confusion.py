@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from confusion import Matrix
+
+
+def reference_df_cm(y, p):
+    """Confusion matrix as the original groupby implementation built it"""
+    labels = np.unique(y)
+    y = np.searchsorted(labels, y)
+    p = np.searchsorted(labels, p)
+    a = np.zeros((len(labels), len(labels)))
+    dfg = pd.DataFrame({'y': y, 'p': p}).groupby(['p', 'y']).size()
+    for (_p, _y), n in dfg.items():
+        a[_y, _p] += n
+    return pd.DataFrame(a, labels, labels)
+
+
+@pytest.fixture
+def labels():
+    rs = np.random.RandomState(0)
+    names = np.array(["beagle", "pug", "collie", "husky", "boxer"])
+    y = names[rs.randint(0, 5, 200)]
+    p = np.where(rs.rand(200) < 0.7, y, names[rs.randint(0, 5, 200)])
+    return list(y), list(p)
+
+
+def test_df_cm_matches_reference(labels):
+    y, p = labels
+    pd.testing.assert_frame_equal(Matrix(y=y, p=p).df_cm,
+                                  reference_df_cm(y, p))
+
+
+def test_numeric_labels_match_reference():
+    y = [0, 1, 2, 2, 1, 0, 2]
+    p = [0, 2, 2, 1, 1, 0, 0]
+    pd.testing.assert_frame_equal(Matrix(y=y, p=p).df_cm,
+                                  reference_df_cm(y, p))
+
+
+def test_incremental_updates_match_one_update(labels):
+    y, p = labels
+    m = Matrix()
+    for n in range(0, len(y), 30):
+        m.update(y[n:n + 30], p[n:n + 30])
+    pd.testing.assert_frame_equal(m.df_cm, Matrix(y=y, p=p).df_cm)
+
+
+def test_sparse_matches_dense(labels):
+    pytest.importorskip("scipy")
+    y, p = labels
+    np.testing.assert_array_equal(Matrix(y=y, p=p, sparse=True).a.toarray(),
+                                  Matrix(y=y, p=p).a)
@@ -0,0 +1,121 @@
+import os
+import hashlib
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+from download import Download
+
+DATA = os.urandom(300000)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves DATA, honoring Range requests unless the server is told to
+    ignore them, optionally cutting the body short"""
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get('Range'))
+        start = 0
+        rng = self.headers.get('Range')
+        if rng and self.server.honor_range:
+            start = int(rng.split('=')[1].split('-')[0])
+            if start >= len(DATA):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(DATA) - 1, len(DATA)))
+        else:
+            self.send_response(200)
+        body = DATA[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.truncate:
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    s = Server(("127.0.0.1", 0), Handler)
+    s.honor_range = True
+    s.truncate = False
+    s.ranges = []
+    t = threading.Thread(target=s.serve_forever, daemon=True)
+    t.start()
+    s.url = "http://127.0.0.1:{}/data.bin".format(s.server_address[1])
+    yield s
+    s.shutdown()
+    s.server_close()
+
+
+def read(fp):
+    with open(fp, 'rb') as f:
+        return f.read()
+
+
+def test_download_verifies_checksum(server, tmp_path):
+    d = str(tmp_path)
+    assert Download.download_data(server.url, d, sha256=SHA256,
+                                  chunk_size=4096)
+    assert read(os.path.join(d, "data.bin")) == DATA
+    assert not os.path.exists(os.path.join(d, "data.bin.part"))
+
+
+def test_resume_with_range(server, tmp_path):
+    d = str(tmp_path)
+    with open(os.path.join(d, "data.bin.part"), 'wb') as f:
+        f.write(DATA[:1000])
+    Download.download_data(server.url, d, sha256=SHA256)
+    assert server.ranges == ["bytes=1000-"]
+    assert read(os.path.join(d, "data.bin")) == DATA
+
+
+def test_server_ignoring_range_restarts(server, tmp_path):
+    server.honor_range = False
+    d = str(tmp_path)
+    with open(os.path.join(d, "data.bin.part"), 'wb') as f:
+        f.write(b"x" * 1000)
+    Download.download_data(server.url, d, sha256=SHA256)
+    assert read(os.path.join(d, "data.bin")) == DATA
+
+
+def test_complete_part_file(server, tmp_path):
+    d = str(tmp_path)
+    with open(os.path.join(d, "data.bin.part"), 'wb') as f:
+        f.write(DATA)
+    Download.download_data(server.url, d, sha256=SHA256)
+    assert read(os.path.join(d, "data.bin")) == DATA
+
+
+def test_checksum_mismatch(server, tmp_path):
+    d = str(tmp_path)
+    with pytest.raises(ValueError):
+        Download.download_data(server.url, d, sha256="0" * 64)
+    assert not os.path.exists(os.path.join(d, "data.bin"))
+    assert not os.path.exists(os.path.join(d, "data.bin.part"))
+
+
+def test_truncated_download_is_not_renamed(server, tmp_path):
+    server.truncate = True
+    d = str(tmp_path)
+    with pytest.raises((IOError, requests.exceptions.RequestException)):
+        Download.download_data(server.url, d)
+    assert not os.path.exists(os.path.join(d, "data.bin"))
+
+    server.truncate = False
+    Download.download_data(server.url, d, sha256=SHA256)
+    assert read(os.path.join(d, "data.bin")) == DATA
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from energy import integrate_windows
+
+
+def calc_W_h_reference(_df, t0, t1):
+    """calc_W_h before integrate_windows"""
+    _df = _df.copy()
+    _df['dt'] = _df.datetime64_ns.diff()
+    _df['dts'] = _df.dt.dt.seconds + (_df.dt.dt.microseconds / 1000000)
+    _df['W_s'] = _df.watts * _df.dts
+
+    _df_in = _df.loc[(_df.datetime64_ns > t0) &
+                     (_df.datetime64_ns < t1)]
+    W_s = _df_in.W_s.sum()
+    dt = _df_in.datetime64_ns.max() - _df_in.datetime64_ns.min()
+    W_mean = _df_in.watts.mean()
+    W_max = _df_in.watts.max()
+    W_min = _df_in.watts.min()
+    W_h = W_s / (60 * 60)
+
+    _df_out = _df[(_df.datetime64_ns < t0) |
+                  (_df.datetime64_ns > t1)]
+    W_mean_off = _df_out.watts.mean()
+    return W_h, dt, W_mean, W_max, W_min, W_mean_off
+
+
+def power_trace(n=200, seed=0):
+    rs = np.random.RandomState(seed)
+    dt_us = rs.randint(50000, 150000, size=n)
+    t = (pd.Timestamp("2019-03-01 10:00:00") +
+         pd.to_timedelta(np.cumsum(dt_us), unit='us'))
+    return pd.DataFrame({"datetime64_ns": t.values,
+                         "watts": rs.uniform(5, 40, size=n)})
+
+
+def test_rectangle_matches_calc_W_h():
+    _df = power_trace()
+    t = _df.datetime64_ns
+    windows = [(t[10], t[50]), (t[0] - pd.Timedelta("1s"), t[199]),
+               (t[20] + pd.Timedelta("1ms"), t[120] - pd.Timedelta("1ms"))]
+    r = integrate_windows(t.values, _df.watts.values,
+                          [w[0] for w in windows], [w[1] for w in windows],
+                          rule='rectangle')
+    for n, (t0, t1) in enumerate(windows):
+        expected = calc_W_h_reference(_df, t0, t1)
+        row = r.iloc[n]
+        np.testing.assert_allclose(
+            [row.W_h, row.W_mean, row.W_max, row.W_min, row.W_mean_off],
+            [expected[0], expected[2], expected[3], expected[4],
+             expected[5]], rtol=1e-12)
+        assert row.duration == expected[1]
+
+
+T = [0.0, 1.0, 2.0, 3.0, 4.0]
+W = [1.0, 2.0, 4.0, 4.0, 1.0]
+
+
+def test_trapezoid_hand_computed():
+    # samples at 1, 2 and 3 s: (2 + 4) / 2 * 1 + (4 + 4) / 2 * 1
+    r = integrate_windows(T, W, 0.5, 3.5).iloc[0]
+    assert r.energy_J == pytest.approx(7.0)
+    assert r.W_h == pytest.approx(7.0 / 3600)
+    assert r.n_samples == 3
+    assert r.W_mean == pytest.approx(10.0 / 3)
+    assert (r.W_max, r.W_min) == (4.0, 2.0)
+    assert r.W_mean_off == pytest.approx(1.0)
+    assert r.duration == pd.Timedelta("2s")
+
+    r = integrate_windows(T, W, 0.5, 3.5, rule='rectangle').iloc[0]
+    assert r.energy_J == pytest.approx(2.0 + 4.0 + 4.0)
+
+
+def test_windows_with_zero_or_one_sample():
+    r = integrate_windows(T, W, [0.2, 1.5, 3.5, -1.0], [0.8, 2.5, 10.0, 0.5])
+
+    empty = r.iloc[0]
+    assert empty.n_samples == 0
+    assert empty.energy_J == 0
+    assert np.isnan(empty.W_mean)
+    assert np.isnan(empty.W_max) and np.isnan(empty.W_min)
+    assert empty.duration == pd.Timedelta(0)
+    assert empty.W_mean_off == pytest.approx(np.mean(W))
+
+    for n, w in [(1, 4.0), (2, 1.0), (3, 1.0)]:
+        one = r.iloc[n]
+        assert one.n_samples == 1
+        assert one.energy_J == 0
+        assert (one.W_mean, one.W_max, one.W_min) == (w, w, w)
+        assert one.duration == pd.Timedelta(0)
+
+    r = integrate_windows(T, W, [0.2, 1.5], [0.8, 2.5], rule='rectangle')
+    assert r.energy_J.tolist() == [0.0, 4.0]
+
+
+def test_fit_clock_recovers_offset_and_drift():
+    from energy import fit_clock
+
+    host = np.linspace(1.55e9, 1.55e9 + 600, 25)
+    ref = host + 2.5 + 2e-5 * (host - host[0])
+    fit = fit_clock(host, ref)
+    assert fit.drift == pytest.approx(2e-5, rel=1e-6)
+    assert fit.offset == pytest.approx(2.5 + 2e-5 * 300, abs=1e-6)
+    np.testing.assert_allclose(fit.to_ref(host), ref, atol=1e-6)
+    assert np.abs(fit.residual_s).max() < 1e-6
+
+    fit = fit_clock(host[:1], ref[:1])
+    assert fit.drift == 0
+    assert fit.offset == pytest.approx(2.5)
+
+
+def test_attribute_energy_splits_batches():
+    from energy import ClockFit, attribute_energy
+
+    start = 1.55e9
+    t = pd.to_datetime(start + 5 + np.arange(0, 4, 0.01), unit='s').values
+    watts = np.full(len(t), 10.0)
+    # host clock 5 s behind the meter, a batch of 3 then a single image
+    df_timings = pd.DataFrame({
+        "file_path": ["a.jpg", "b.jpg", "c.jpg", "d.jpg"],
+        "wall_start": [start + 1.0] * 3 + [start + 2.0],
+        "wall_end": [start + 1.3] * 3 + [start + 2.2]})
+    df = pd.DataFrame({"file_path": ["d.jpg", "c.jpg", "b.jpg", "a.jpg"],
+                       "p_label": ["x", "y", "z", "w"]})
+
+    r = attribute_energy(df, df_timings, t, watts, clock=ClockFit(offset=5),
+                         idle_watts=4.0)
+    assert r.file_path.tolist() == ["d.jpg", "c.jpg", "b.jpg", "a.jpg"]
+    assert r.p_label.tolist() == ["x", "y", "z", "w"]
+    np.testing.assert_allclose(r.energy_J, [2.0, 1.0, 1.0, 1.0], rtol=1e-5)
+    np.testing.assert_allclose(r.energy_net_J, [1.2, 0.6, 0.6, 0.6],
+                               rtol=1e-5)
+    assert r.t0.iloc[3] == pd.Timestamp(start + 6, unit='s')
@@ -0,0 +1,72 @@
+import time
+import asyncio
+import threading
+
+import pandas as pd
+import pytest
+
+from client import Telemetry, AsyncTelemetry
+from server import EventServer, read_events
+from parse import read_profile_window
+
+
+@pytest.fixture
+def event_server(tmp_path):
+    """EventServer on a free localhost port, served from a thread"""
+    loop = asyncio.new_event_loop()
+    es = EventServer(host="127.0.0.1", port=0,
+                     log_file=str(tmp_path / "events.csv"),
+                     flush_interval=0.05)
+    loop.run_until_complete(es.start())
+    es.port = es.server.sockets[0].getsockname()[1]
+    t = threading.Thread(target=loop.run_forever, daemon=True)
+    t.start()
+    yield es
+    loop.call_soon_threadsafe(loop.stop)
+    t.join()
+    loop.run_until_complete(es.stop())
+    loop.close()
+
+
+def wait_for(es, n_events, timeout=5.0):
+    t0 = time.time()
+    while es.n_events < n_events and time.time() - t0 < timeout:
+        time.sleep(0.01)
+    time.sleep(0.1)  # let the log flush
+
+
+def test_legacy_client_messages_are_framed(event_server):
+    t = Telemetry(server_ip="127.0.0.1")
+    t.server_port = event_server.port
+    t.connect()
+    t.send("profile_start")
+    t.send("profile_end")
+    wait_for(event_server, 2)
+    assert event_server.n_events == 2
+    df = read_events(event_server.log_file)
+    assert df.m.tolist() == ["profile_start", "profile_end"]
+    t.s.close()
+
+
+def test_async_client_events_give_profile_window(event_server):
+    t = AsyncTelemetry(server_ip="127.0.0.1", server_port=event_server.port)
+    t.connect()
+    t.send("profile_start")
+    t.send("sync 0")
+    t.send("profile_end")
+    wait_for(event_server, 3)
+    t.close()
+
+    df = read_events(event_server.log_file)
+    start, end = read_profile_window(event_server.log_file)
+    assert start == df.recv_datetime64_ns.iloc[0]
+    assert end == df.recv_datetime64_ns.iloc[2]
+
+
+def test_legacy_profile_output(tmp_path):
+    fp = tmp_path / "profile_output.txt"
+    fp.write_text("2019-03-01 10:00:00.5,profile_start\n"
+                  "2019-03-01 10:01:00.25,profile_end\n")
+    start, end = read_profile_window(str(fp))
+    assert start == pd.Timestamp("2019-03-01 10:00:00.5")
+    assert end == pd.Timestamp("2019-03-01 10:01:00.25")
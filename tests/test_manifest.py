@@ -0,0 +1,56 @@
+import os
+import tarfile
+
+import numpy as np
+
+from manifest import DatasetManifest
+from fakes import FakeClassifier, make_dataset
+
+
+def test_class_names_follow_each_callers_name_fn(tmp_path):
+    dataset = make_dataset(tmp_path / "images", n_classes=3, per_class=4)
+    m = FakeClassifier()
+
+    folders = DatasetManifest.open(dataset, os.path.basename)
+    assert folders.class_names.tolist() == ["n00000000-class_0",
+                                            "n00000001-class_1",
+                                            "n00000002-class_2"]
+    assert sorted(set(name for name, f in m.list_dataset(dataset))) == \
+        ["class_0", "class_1", "class_2"]
+    # and again in the other order, now from the saved manifest
+    assert os.path.exists(os.path.join(dataset, DatasetManifest.file_name))
+    again = DatasetManifest.open(dataset, os.path.basename)
+    assert again.class_names.tolist() == folders.class_names.tolist()
+
+
+def test_manifest_rebuilt_when_a_class_folder_changes(tmp_path):
+    dataset = make_dataset(tmp_path / "images", n_classes=2, per_class=3)
+    assert len(DatasetManifest.open(dataset, os.path.basename)) == 6
+    class_dir = os.path.join(dataset, "n00000000-class_0")
+    open(os.path.join(class_dir, "extra.jpg"), "wb").close()
+    os.utime(class_dir, ns=(0, os.stat(class_dir).st_mtime_ns + 10**9))
+    assert len(DatasetManifest.open(dataset, os.path.basename)) == 7
+
+
+def test_subsample_is_stratified_and_deterministic(tmp_path):
+    dataset = make_dataset(tmp_path / "images", n_classes=3, per_class=5)
+    m = DatasetManifest.open(dataset, os.path.basename)
+    idx = m.subsample(2, seed=3)
+    assert np.bincount(m.class_id[idx]).tolist() == [2, 2, 2]
+    assert m.subsample(2, seed=3).tolist() == idx.tolist()
+    assert len(m.subsample(10)) == 15
+
+
+def test_archive_matches_folder(tmp_path):
+    dataset = make_dataset(tmp_path / "Images", n_classes=2, per_class=3)
+    tar_path = str(tmp_path / "images.tar")
+    with tarfile.open(tar_path, "w") as tar:
+        tar.add(dataset, arcname="Images")
+    m = FakeClassifier()
+    from_tar = m.list_dataset(tar_path)
+    from_folder = m.list_dataset(dataset)
+    assert [name for name, f in from_tar] == [name for name, f in from_folder]
+    m.predict_files(from_tar)
+    p_tar = m.d
+    m.predict_files(from_folder)
+    assert m.d == p_tar
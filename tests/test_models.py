@@ -0,0 +1,163 @@
+import numpy as np
+import pytest
+
+from fakes import FakeClassifier, make_dataset
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    return make_dataset(tmp_path / "images", n_classes=3, per_class=4)
+
+
+def per_image(m, files):
+    d = {}
+    for name, f_path in files:
+        d.setdefault(name, []).append(m.predict_file(f_path))
+    return d
+
+
+@pytest.mark.parametrize("batch_size", [1, 5, 12, 20])
+def test_batched_matches_per_image(dataset, batch_size):
+    m = FakeClassifier(batch_size=batch_size)
+    files = m.list_dataset(dataset)
+    expected = per_image(FakeClassifier(), files)
+
+    m.predict_files(files)
+
+    assert m.d == expected
+    # 12 images, so 5 per batch ends with a partial batch of 2
+    assert m.n_calls == -(-len(files) // batch_size)
+
+
+def test_prefetch_matches_inline(dataset):
+    m = FakeClassifier(batch_size=5)
+    files = m.list_dataset(dataset)
+    m.predict_files(files, prefetch=0)
+    inline = m.d
+    m.predict_files(files, prefetch=4, workers=3)
+    assert m.d == inline
+
+
+def test_collate_predictions_aligns_file_paths(dataset):
+    m = FakeClassifier(batch_size=5)
+    m.predict_dataset(dataset)
+    m.collate_predictions()
+    ref = FakeClassifier()
+    assert len(m.df) == len(m.files)
+    for row in m.df.itertuples():
+        assert row.y_pred == ref.predict_file(row.file_path)
+
+
+def test_timings_cover_every_image(dataset):
+    m = FakeClassifier(batch_size=5)
+    m.predict_dataset(dataset)
+    assert m.timings.ns.shape == (12, 5)
+    assert not np.isnan(m.timings.wall).any()
+
+
+def test_sharded_matches_single_process(dataset):
+    from labels import LabelDecoder
+
+    m = FakeClassifier(batch_size=5)
+    m.labels = LabelDecoder(["other_{}".format(n) for n in range(7)])
+    m.predict_dataset(dataset)
+    expected = m.d
+
+    m.predict_dataset_sharded(dataset, processes=2)
+    assert m.d == expected
+    assert m.shard_stats.n_images.sum() == 12
+    stats = m.pipeline_stats
+    assert stats["predict_s"] == m.shard_stats.predict_s.max()
+    assert stats["images_per_s"] == 12 / stats["predict_s"]
+    assert stats["wall_s"] > stats["load_s"] + stats["predict_s"]
+
+
+def test_sharded_rejects_process_pool(dataset):
+    m = FakeClassifier()
+    with pytest.raises(ValueError):
+        m.predict_dataset_sharded(dataset, processes=2, pool='process')
+
+
+
+class FakeInterpreter:
+    """Linear 'model' over (batch, 2, 2, 3) images with the TFLite
+    interpreter methods used by ClassifyTFLite, invoke fails while an
+    input tensor view is held like the real one"""
+
+    def __init__(self, W, dtype=np.float32, quantization=(0.0, 0)):
+        self.W = W
+        self.dtype = dtype
+        self.quantization = quantization
+        self.inputs = np.zeros((1, 2, 2, 3), dtype=dtype)
+        self.outputs = None
+        self.views = 0
+
+    def get_input_details(self):
+        return [{"index": 0, "shape": np.array(self.inputs.shape),
+                 "dtype": self.dtype, "quantization": self.quantization}]
+
+    def get_output_details(self):
+        return [{"index": 1, "quantization": (0.0, 0)}]
+
+    def resize_tensor_input(self, index, shape):
+        self.inputs = np.zeros(shape, dtype=self.dtype)
+
+    def allocate_tensors(self):
+        pass
+
+    def tensor(self, index):
+        self.views += 1
+        return lambda: self.inputs
+
+    def invoke(self):
+        import sys
+        if sys.getrefcount(self.inputs) > 2:
+            raise RuntimeError("input tensor view held during invoke")
+        x = self.inputs.reshape(len(self.inputs), -1).astype(np.float32)
+        self.outputs = x.dot(self.W)
+
+    def get_tensor(self, index):
+        return self.outputs
+
+
+def load_tflite(tmp_path, monkeypatch, interpreter, batch_size=3):
+    import models
+
+    label_file = tmp_path / "labels.txt"
+    label_file.write_text("0    zero\n1    one\n2    two\n")
+    monkeypatch.setattr(models, "tflite_interpreter",
+                        lambda: lambda **kwargs: interpreter)
+    m = models.ClassifyTFLite(batch_size=batch_size)
+    m.load_model(label_file=str(label_file), model_file="fake.tflite")
+    return m
+
+
+@pytest.mark.parametrize("n_images", [1, 4, 7])
+def test_tflite_writes_into_input_tensor(tmp_path, monkeypatch, n_images):
+    rs = np.random.RandomState(0)
+    W = rs.rand(12, 3).astype(np.float32)
+    m = load_tflite(tmp_path, monkeypatch, FakeInterpreter(W))
+    assert m.prepare_kwargs == {"to_array": True, "scale": True}
+    inputs = list(rs.rand(n_images, 2, 2, 3).astype(np.float32))
+    outputs = m.run_model(inputs)
+    expected = np.stack(inputs).reshape(n_images, -1).dot(W)
+    np.testing.assert_allclose(outputs, expected, rtol=1e-5)
+    assert m.model.views == -(-n_images // 3)
+
+
+def test_tflite_quantizes_int8_inputs(tmp_path, monkeypatch):
+    W = np.eye(12, 3, dtype=np.float32)
+    interpreter = FakeInterpreter(W, np.int8, quantization=(1 / 128, -1))
+    m = load_tflite(tmp_path, monkeypatch, interpreter, batch_size=1)
+    assert m.prepare_kwargs == {"to_array": True, "scale": True}
+    image_a = np.full((2, 2, 3), -1.0, dtype=np.float32)
+    image_a[0, 0] = [1.0, 0.5, 0.0]
+    m.run_model([image_a])
+    assert interpreter.inputs[0, 0, 0].tolist() == [127, 63, -1]
+    assert interpreter.inputs[0, 1, 1].tolist() == [-128, -128, -128]
+
+
+def test_tflite_rejects_unsupported_input_dtype(tmp_path, monkeypatch):
+    W = np.eye(12, 3, dtype=np.float32)
+    with pytest.raises(ValueError):
+        load_tflite(tmp_path, monkeypatch, FakeInterpreter(W, np.int16))
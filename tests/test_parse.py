@@ -0,0 +1,172 @@
+import os
+import json
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+import config
+import parse
+
+
+def write_power_csv(fp):
+    meta = {"delimiter": ",", "comment": "#", "time_format": "std_time",
+            "strfmtime": "%Y-%m-%d %H:%M:%S.%f"}
+    lines = ["#!" + json.dumps(meta), "std_time,voltage,current"]
+    for n in range(20):
+        lines.append("2019-03-01 10:00:{:02d}.000000,5.0,{}".format(n,
+                                                                   0.5 + n))
+    with open(fp, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def test_power_cache_is_kept_with_the_data(tmp_path):
+    fp = str(tmp_path / "run_001 - power.csv")
+    write_power_csv(fp)
+    before = os.listdir(config.data_directory) if os.path.exists(
+        config.data_directory) else []
+
+    meta, df = parse.load_power(fp)
+    cache_dir = tmp_path / ".cache" / "power"
+    with open(str(cache_dir / "run_001 - power.csv.json")) as f:
+        fmt = json.load(f)["format"]
+    assert os.path.exists(str(cache_dir / ("run_001 - power.csv" +
+                                           parse.FRAME_EXTENSIONS[fmt])))
+    after = os.listdir(config.data_directory) if os.path.exists(
+        config.data_directory) else []
+    assert before == after
+
+    meta_cached, df_cached = parse.load_power(fp)
+    assert meta_cached == meta
+    assert df_cached.equals(df)
+    assert str(df.datetime64_ns.dtype) == "datetime64[ns]"
+
+
+def test_power_integer_readings_then_floats(tmp_path):
+    fp = str(tmp_path / "run_002 - power.csv")
+    meta = {"delimiter": ",", "comment": "#", "time_format": "std_time",
+            "strfmtime": "%Y-%m-%d %H:%M:%S.%f"}
+    lines = ["#!" + json.dumps(meta), "std_time,voltage,current"]
+    for n in range(1500):
+        current = "0" if n < 1200 else "{:.3f}".format(n / 1000)
+        lines.append("2019-03-01 10:{:02d}:{:02d}.000000,5,{}".format(
+            n // 60, n % 60, current))
+    with open(fp, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+    meta, df = parse.load_power(fp, chunksize=1000, cache=False)
+    assert len(df) == 1500
+    assert str(df.current.dtype) == "float64"
+    assert df.current.iloc[0] == 0
+    assert df.current.iloc[-1] == 1.499
+    assert df.voltage.eq(5).all()
+
+
+def load_module(path, name):
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(name, str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def caller(work_a, work_b):
+    for n in range(3):
+        work_a()
+    work_b()
+
+
+def profiled_run(tmp_path):
+    """Pstats of a real cProfile run calling two functions with the same
+    'util.py:1(work)' short name"""
+    import cProfile
+
+    modules = []
+    for d in ["a", "b"]:
+        (tmp_path / d).mkdir()
+        (tmp_path / d / "util.py").write_text(
+            "def work():\n    return sum(range(1000))\n")
+        modules.append(load_module(tmp_path / d / "util.py", "util_" + d))
+
+    profile = cProfile.Profile()
+    profile.runcall(caller, modules[0].work, modules[1].work)
+    fp = str(tmp_path / "linux_i7_CPU_1.10_001 - pstats.txt")
+    profile.dump_stats(fp)
+    with open(str(tmp_path / "linux_i7_CPU_1.10_001 - predictions.csv"),
+              'w') as f:
+        f.write("y_true,y_pred,y_pred_dog\nx,x,True\nx,y,False\n")
+    return parse.Pstats(fp), [str(tmp_path / d / "util.py")
+                              for d in ["a", "b"]]
+
+
+def test_pstats_table_and_call_graph(tmp_path):
+    p, util_files = profiled_run(tmp_path)
+    assert p.platform == "linux" and p.run_id == "001"
+    assert p.acc == 0.5
+
+    key_a = pstats.func_std_string((util_files[0], 1, "work"))
+    key_b = pstats.func_std_string((util_files[1], 1, "work"))
+    assert p.df.at[key_a, "ncalls"] == 3
+    assert p.df.at[key_b, "ncalls"] == 1
+    assert p.calc_time(key_a) == p.p.stats[(util_files[0], 1, "work")][3]
+    with pytest.raises(KeyError):
+        p.calc_time("util.py:1(work)")
+
+    short = "test_parse.py:{}(caller)".format(caller.__code__.co_firstlineno)
+    assert p.calc_time(short) == p.df.cumtime[p.df.short_name == short].iloc[0]
+
+    callees = p.callees(short).set_index("filename:lineno(function)")
+    assert callees.at[key_a, "ncalls"] == 3
+    assert callees.at[key_b, "ncalls"] == 1
+    callers = p.callers(key_a)
+    assert callers["filename:lineno(function)"].tolist() == [
+        pstats.func_std_string((__file__, caller.__code__.co_firstlineno,
+                                "caller"))]
+    assert callers.ncalls.tolist() == [3]
+
+
+class RecordingExecutor(ThreadPoolExecutor):
+    """Runs compile_results tasks in threads and records them"""
+    tasks = []
+
+    def map(self, fn, tasks):
+        tasks = list(tasks)
+        RecordingExecutor.tasks.extend(tasks)
+        return super().map(fn, tasks)
+
+
+def test_compile_results_reparses_only_changed_files(tmp_path, monkeypatch):
+    import cProfile
+    from concurrent import futures
+
+    monkeypatch.setattr(futures, "ProcessPoolExecutor", RecordingExecutor)
+    monkeypatch.setattr(RecordingExecutor, "tasks", [])
+    data_directory = str(tmp_path)
+    for run_id in ["001", "002"]:
+        name = os.path.join(data_directory, "linux_i7_CPU_1.10_" + run_id)
+        profile = cProfile.Profile()
+        profile.runcall(sum, range(1000))
+        profile.dump_stats(name + " - pstats.txt")
+        with open(name + " - predictions.csv", 'w') as f:
+            f.write("y_true,y_pred,y_pred_dog\nx,x,True\n")
+
+    df_stats, df_power = parse.compile_results(data_directory)
+    assert sorted(df_stats.run_id) == ["001", "002"]
+    assert len(df_power) == 0
+    assert len(RecordingExecutor.tasks) == 2
+
+    RecordingExecutor.tasks = []
+    df_cached, _ = parse.compile_results(data_directory)
+    assert RecordingExecutor.tasks == []
+    assert df_cached.equals(df_stats)
+
+    fp = os.path.join(data_directory, "linux_i7_CPU_1.10_002 - pstats.txt")
+    st = os.stat(fp)
+    os.utime(fp, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    df_touched, _ = parse.compile_results(data_directory)
+    assert RecordingExecutor.tasks == [
+        ("pstats", ("linux_i7_CPU_1.10_002 - pstats.txt",),
+         {"data_directory": data_directory})]
+    assert df_touched.equals(df_stats)
@@ -0,0 +1,106 @@
+"""Per-image, per-stage latency recording"""
+
+import time
+import numpy as np
+
+# perf_counter_ns is new in Python 3.7
+try:
+    now_ns = time.perf_counter_ns
+except AttributeError:
+    def now_ns():
+        return int(time.perf_counter() * 1e9)
+
+STAGES = ("read", "decode", "scale", "model", "label")
+
+
+class StageTimer:
+    """Preallocated nanosecond timings for each image and pipeline stage
+
+    Parameters
+    ----------
+    n : int, number of images
+    stages : tuple of str, stage names, one column each
+
+    Attributes
+    ----------
+    ns : Numpy Array of int64, shape (n, len(stages)), nanoseconds
+    wall : Numpy Array of float64, shape (n, 2), wall clock seconds since
+        the epoch at the start and end of the model call for each image,
+        used to line images up with a power trace
+    """
+
+    def __init__(self, n, stages=STAGES):
+        self.stages = tuple(stages)
+        self.columns = {s: i for i, s in enumerate(self.stages)}
+        self.ns = np.zeros((n, len(self.stages)), dtype=np.int64)
+        self.wall = np.full((n, 2), np.nan)
+
+    def __len__(self):
+        return len(self.ns)
+
+    def add(self, index, stage, ns):
+        """Record a stage duration
+
+        Parameters
+        ----------
+        index : int or slice, image row(s) to record to
+        stage : str, stage name
+        ns : int, nanoseconds spent in stage for each row
+        """
+        self.ns[index, self.columns[stage]] += ns
+
+    def to_frame(self):
+        """Raw timings as a Pandas DataFrame, one column per stage in ns,
+        plus 'wall_start' and 'wall_end' in seconds"""
+        import pandas as pd
+
+        df = pd.DataFrame(self.ns, columns=self.stages)
+        df["wall_start"] = self.wall[:, 0]
+        df["wall_end"] = self.wall[:, 1]
+        return df
+
+    def percentiles(self, q=(50, 90, 99)):
+        """Latency percentiles for each stage
+
+        Parameters
+        ----------
+        q : tuple of int, percentiles to report
+
+        Returns
+        -------
+        Pandas DataFrame, one row per stage with columns p<q> and max
+            in milliseconds, plus a 'total' row for the sum of stages
+        """
+        import pandas as pd
+
+        a = np.hstack([self.ns, self.ns.sum(axis=1, keepdims=True)]) / 1e6
+        if len(a) == 0:
+            a = np.full((1, a.shape[1]), np.nan)
+        data = {"p{}".format(_q): np.percentile(a, _q, axis=0) for _q in q}
+        data["max"] = a.max(axis=0)
+        return pd.DataFrame(data, index=list(self.stages) + ["total"])
+
+
+def confidence_interval(x, confidence=0.95):
+    """Student t confidence interval of the mean
+
+    Parameters
+    ----------
+    x : array-like, repeated measurements
+    confidence : float, confidence level
+
+    Returns
+    -------
+    mean : float
+    low : float, lower bound, nan with fewer than 2 measurements
+    high : float, upper bound, nan with fewer than 2 measurements
+    """
+    from scipy import stats
+
+    x = np.asarray(x, dtype=float)
+    mean = x.mean()
+    if len(x) < 2:
+        return mean, np.nan, np.nan
+    half = (stats.t.ppf((1 + confidence) / 2, len(x) - 1) *
+            x.std(ddof=1) / np.sqrt(len(x)))
+    return mean, mean - half, mean + half